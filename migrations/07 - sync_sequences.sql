@@ -0,0 +1,3 @@
+SELECT SETVAL(PG_GET_SERIAL_SEQUENCE('PRODUCT', 'id_product'), COALESCE(MAX(ID_PRODUCT), 0) + 1, FALSE) FROM PRODUCT;
+SELECT SETVAL(PG_GET_SERIAL_SEQUENCE('DATA', 'id_data'), COALESCE(MAX(ID_DATA), 0) + 1, FALSE) FROM DATA;
+SELECT SETVAL(PG_GET_SERIAL_SEQUENCE('PRODUCT_DATA', 'id_product_data'), COALESCE(MAX(ID_PRODUCT_DATA), 0) + 1, FALSE) FROM PRODUCT_DATA;
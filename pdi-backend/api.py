@@ -1,22 +1,43 @@
-from flask import Flask, request, jsonify
+import atexit
+
+from flask import Flask, Response, request, jsonify
+
+import metrics
+from index_store import INDEX_STORE_PATH
 from knn_process_image import KNN
 from flask_cors import CORS
-from process_image_method import process_image_exec, process_image_confirm_exec
+from process_image_method import process_image_exec, process_image_confirm_exec, process_image_batch_exec
+from write_behind import WriteBehind
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
-knn_default = KNN()
+# Com INDEX_STORE_PATH (produção, ver gunicorn.conf.py) o índice é anexado da versão publicada.
+knn_default = KNN(index_store=INDEX_STORE_PATH)
+write_behind_default = WriteBehind().start()
+atexit.register(write_behind_default.shutdown)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/process-image', methods=['POST'])
 def process_image_route():
-    return process_image_exec(request, knn_default)
+    return process_image_exec(request, knn_default, write_behind_default)
+
+@app.route('/process-image/batch', methods=['POST'])
+def process_image_batch_route():
+    return process_image_batch_exec(request, knn_default, write_behind_default)
 
 @app.route('/process-image/confirm', methods=['POST'])
 def process_image_confirm_route():
-    return process_image_confirm_exec(request)
+    return process_image_confirm_exec(request, knn_default, write_behind_default)
+
+@app.route('/catalog/refresh', methods=['POST'])
+def catalog_refresh_route():
+    return jsonify({'products': knn_default.refresh_catalog()}), 200
 
 @app.errorhandler(413)
 def too_large(e):
@@ -33,8 +54,13 @@ def not_found(e):
 def internal_error(e):
     return jsonify({'error': 'Erro interno do servidor', 'code': 'INTERNAL_ERROR'}), 500
 
+@app.before_request
+def before_request():
+    metrics.start_request()
+
 @app.after_request
 def after_request(response):
+    metrics.finish_request(response, request.url_rule.rule if request.url_rule else 'unmatched')
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
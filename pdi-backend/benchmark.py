@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmark_index import list_dataset, percentiles_ms, read_image, DATASET_PATH
+from bulk_loader import extract_features
+from knn_process_image import KNN, KNN_CONFIG, INDEX_BACKENDS, INDEX_EXACT, INDEX_CASCADE, ExactIndex, standardize
+from libs.knn_process import ajustar_tamanho_vetor, hash_pipeline_config, dimensao_histograma_cor, \
+    CONFIG_TEXTURA_RAPIDA, CONFIG_CASCATA
+from libs.timers import coletar_tempos
+
+DATASET_TEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_test')
+CASCADE_SHORTLISTS = (25, 50, 100, 200, 500)
+STAGES = ['normalizar', 'histograma_cor', 'rgb', 'cinza', 'suavizacao', 'canny', 'segmentacao', 'contornos',
+          'contornos_filtrados', 'metricas_geo', 'roi', 'cinza_roi', 'contornos_desenhados', 'hog', 'hog_visual', 'lbp',
+          'lbp_visual', 'glcm']
+
+
+def peak_rss_mb():
+    return {'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),  #
+            'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)  #
+            }
+
+
+def stage_report(stage_times):
+    report = {}
+    for stage in STAGES + sorted(set(stage_times) - set(STAGES)):
+        if stage in stage_times:
+            report[stage] = percentiles_ms(stage_times[stage])
+            report[stage]['total_s'] = round(float(np.sum(stage_times[stage])), 4)
+    return report
+
+
+def build_knn(config=KNN_CONFIG, step=1, workers=1, n_neighbors=10, index_backend=INDEX_EXACT, index_params=None,
+              padronizar=True):
+    """
+    Monta o KNN a partir das pastas por classe de dataset/, sem MinIO nem Postgres.
+    Com workers=1 os tempos por etapa da extração também são coletados.
+    """
+    files = list_dataset(DATASET_PATH, step)
+    classes = {classe: id_product for id_product, classe in enumerate(sorted({c for _, c in files}))}
+
+    started_at = time.perf_counter()
+    images = [read_image(arquivo, config) for arquivo, _ in files]
+    read_s = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    with coletar_tempos() as tempos:
+        features = extract_features(images, config, workers)
+    extract_s = time.perf_counter() - started_at
+
+    valid = [i for i, f in enumerate(features) if f is not None]
+    max_len = max(len(features[i]) for i in valid)
+    feature_matrix = np.vstack([ajustar_tamanho_vetor(features[i], max_len) for i in valid])
+    df_database_images = pd.DataFrame({'id_data': np.arange(len(valid)),  #
+                                       'path_data': [files[i][0] for i in valid],  #
+                                       'id_product': [classes[files[i][1]] for i in valid]  #
+                                       })
+
+    started_at = time.perf_counter()
+    knn = KNN(config=config, workers=workers, n_neighbors=n_neighbors, index_backend=index_backend,
+              index_params=index_params, autoload=False, standardize=padronizar)
+    knn.load_from_matrix(df_database_images, feature_matrix)
+    index_s = time.perf_counter() - started_at
+
+    report = {'images': len(valid),  #
+              'dim': int(feature_matrix.shape[1]),  #
+              'read_s': round(read_s, 4),  #
+              'extract_s': round(extract_s, 4),  #
+              'index_s': round(index_s, 4),  #
+              'stage_total_s': {k: round(v, 4) for k, v in tempos.items()}  #
+              }
+    return knn, classes, report
+
+
+def query_dataset_test(knn, classes, top_k=3):
+    latencies, stage_times = [], {}
+    top1 = topk = total = unreadable = 0
+    unknown_classes = set()
+
+    for arquivo, classe in list_dataset(DATASET_TEST_PATH):
+        image = read_image(arquivo, knn.config)
+        if image is None:
+            unreadable += 1
+            continue
+        if classe not in classes:
+            unknown_classes.add(classe)
+
+        started_at = time.perf_counter()
+        with coletar_tempos() as tempos:
+            candidates = knn.knn_process_image(image, [], top_products=top_k)
+        latencies.append(time.perf_counter() - started_at)
+
+        for stage, segundos in tempos.items():
+            stage_times.setdefault(stage, []).append(segundos)
+
+        ranking = [c['id_product'] for c in candidates]
+        total += 1
+        top1 += bool(ranking) and ranking[0] == classes.get(classe)
+        topk += classes.get(classe) in ranking
+
+    return {'queries': total,  #
+            'unreadable': unreadable,  #
+            'classes_missing_from_catalog': sorted(unknown_classes),  #
+            'latency_ms': percentiles_ms(latencies),  #
+            'stage_ms': stage_report(stage_times),  #
+            'top1_accuracy': round(top1 / max(total, 1), 4),  #
+            f'top{top_k}_accuracy': round(topk / max(total, 1), 4)  #
+            }
+
+
+def catalog_leave_one_out(knn, top_k=3):
+    """
+    Consulta cada imagem do catálogo contra as demais. Como dataset/ tem quadros
+    consecutivos quase idênticos, é otimista; serve para comparar configurações.
+    """
+    path_data = knn.metadata['path_data']
+    top1 = topk = 0
+
+    for i, (distances, indices) in enumerate(knn.index.query(knn.index.vectors, knn.n_neighbors + 1)):
+        neighbors = [{'id_product': knn.product_ids[idx],  #
+                      'image_path': path_data[idx],  #
+                      'distance': float(distance)  #
+                      } for distance, idx in zip(distances, indices) if idx != i][:knn.n_neighbors]
+        ranking = [c['id_product'] for c in knn.__vote__(neighbors, top_k)]
+        top1 += bool(ranking) and ranking[0] == knn.product_ids[i]
+        topk += knn.product_ids[i] in ranking
+
+    total = max(len(knn.index), 1)
+    return {'top1_accuracy': round(top1 / total, 4), f'top{top_k}_accuracy': round(topk / total, 4)}
+
+
+def run(config=KNN_CONFIG, step=1, workers=1, n_neighbors=10, top_k=3, index_backend=INDEX_EXACT, index_params=None,
+        padronizar=True):
+    knn, classes, build = build_knn(config, step, workers, n_neighbors, index_backend, index_params, padronizar)
+    queries = query_dataset_test(knn, classes, top_k)
+    catalog = catalog_leave_one_out(knn, top_k)
+
+    return {'config': config,  #
+            'config_hash': hash_pipeline_config(config),  #
+            'index_backend': index_backend,  #
+            'index_params': index_params or {},  #
+            'standardize': padronizar,  #
+            'k': n_neighbors,  #
+            'step': step,  #
+            'build': build,  #
+            'query': queries,  #
+            'catalog_leave_one_out': catalog,  #
+            'memory': knn.memory_usage(),  #
+            'peak_rss_mb': peak_rss_mb()  #
+            }
+
+
+def compare_texture(config=KNN_CONFIG, step=1, workers=1, n_neighbors=10, top_k=3, index_backend=INDEX_EXACT,
+                    index_params=None, padronizar=True):
+    """
+    Roda o benchmark com a textura padrão e com CONFIG_TEXTURA_RAPIDA mesclada por cima,
+    resumindo o ganho de tempo e a diferença de acurácia.
+    """
+    baseline = run(config, step, workers, n_neighbors, top_k, index_backend, index_params, padronizar)
+    fast = run({**config, **CONFIG_TEXTURA_RAPIDA}, step, workers, n_neighbors, top_k, index_backend, index_params,
+               padronizar)
+
+    def summary(report):
+        query = report['query']
+        return {'extract_s': report['build']['extract_s'],  #
+                'glcm_p50_ms': query['stage_ms'].get('glcm', {}).get('p50'),  #
+                'lbp_p50_ms': query['stage_ms'].get('lbp', {}).get('p50'),  #
+                'query_p50_ms': query['latency_ms']['p50'],  #
+                'top1_accuracy': query['top1_accuracy'],  #
+                f'top{top_k}_accuracy': query[f'top{top_k}_accuracy'],  #
+                'catalog_top1_accuracy': report['catalog_leave_one_out']['top1_accuracy']  #
+                }
+
+    return {'baseline': baseline, 'fast': fast, 'summary': {'baseline': summary(baseline), 'fast': summary(fast)}}
+
+
+def search_report(knn, index, query_vecs, labels, top_k=3, exact_results=None, leave_one_out=False):
+    """
+    Só a busca no índice (sem extração), consulta a consulta, com a votação do KNN.
+    Com leave_one_out, a consulta i é a linha i do índice e não conta como vizinha.
+    """
+    path_data = knn.metadata['path_data']
+    latencies, results = [], []
+    top1 = topk = 0
+
+    for i, (query_vec, label) in enumerate(zip(query_vecs, labels)):
+        started_at = time.perf_counter()
+        distances, indices = index.query(query_vec, knn.n_neighbors + leave_one_out)[0]
+        latencies.append(time.perf_counter() - started_at)
+        if leave_one_out:
+            keep = indices != i
+            distances, indices = distances[keep][:knn.n_neighbors], indices[keep][:knn.n_neighbors]
+        results.append(indices)
+
+        neighbors = [{'id_product': knn.product_ids[idx],  #
+                      'image_path': path_data[idx],  #
+                      'distance': float(distance)  #
+                      } for distance, idx in zip(distances, indices)]
+        ranking = [c['id_product'] for c in knn.__vote__(neighbors, top_k)]
+        top1 += bool(ranking) and ranking[0] == label
+        topk += label in ranking
+
+    total = max(len(labels), 1)
+    report = {'search_ms': percentiles_ms(latencies),  #
+              'top1_accuracy': round(top1 / total, 4),  #
+              f'top{top_k}_accuracy': round(topk / total, 4)  #
+              }
+    if exact_results is not None:
+        hits = sum(len(np.intersect1d(r, e)) for r, e in zip(results, exact_results))
+        report['recall_at_k'] = round(hits / max(sum(len(e) for e in exact_results), 1), 4)
+    return report, results
+
+
+def compare_cascade(config=KNN_CONFIG, step=1, workers=1, n_neighbors=10, top_k=3, shortlists=CASCADE_SHORTLISTS,
+                    padronizar=True):
+    """
+    Cascata (CONFIG_CASCATA + CascadeIndex) contra a busca exata só pelo descritor,
+    sobre as mesmas consultas de dataset_test/ e, em catalog, com cada imagem do
+    catálogo consultada contra as demais (dataset_test/ tem poucas imagens). Para
+    cada tamanho de shortlist M reporta a latência da busca, o recall dos k
+    vizinhos exatos e a acurácia; a extração do histograma na consulta aparece à
+    parte em query_stage_ms.
+    """
+    config = {**config, **CONFIG_CASCATA}
+    knn, classes, build = build_knn(config, step, workers, n_neighbors, INDEX_CASCADE, padronizar=padronizar)
+    prefilter_dim = dimensao_histograma_cor(config)
+
+    query_vecs, labels, stage_times = [], [], {}
+    for arquivo, classe in list_dataset(DATASET_TEST_PATH):
+        image = read_image(arquivo, config)
+        if image is None:
+            continue
+        with coletar_tempos() as tempos:
+            query_vecs.append(ajustar_tamanho_vetor(knn.process_image_pdi_concat(image), knn.index.dim))
+        for stage, segundos in tempos.items():
+            stage_times.setdefault(stage, []).append(segundos)
+        labels.append(classes.get(classe))
+    # O índice guarda os vetores padronizados; as consultas passam pelo mesmo scaler, como em KNN.__search__.
+    query_vecs = standardize(np.vstack(query_vecs), knn.scaler)
+
+    # Referência: busca exata nas colunas do descritor, a mesma métrica do re-rank.
+    exact = ExactIndex().build(knn.index.vectors[:, prefilter_dim:])
+    report = {'config': config,  #
+              'config_hash': hash_pipeline_config(config),  #
+              'prefilter_dim': prefilter_dim,  #
+              'standardize': padronizar,  #
+              'k': n_neighbors,  #
+              'build': build,  #
+              'query_stage_ms': stage_report(stage_times)  #
+              }
+    report['exact'], exact_results = search_report(knn, exact, [q[prefilter_dim:] for q in query_vecs], labels,
+                                                   top_k)
+    report['catalog_exact'], catalog_exact_results = search_report(knn, exact, exact.vectors, knn.product_ids, top_k,
+                                                                   leave_one_out=True)
+
+    report['cascade'] = []
+    for shortlist in shortlists:
+        knn.index.shortlist = shortlist
+        cascade_report, _ = search_report(knn, knn.index, query_vecs, labels, top_k, exact_results)
+        catalog_report, _ = search_report(knn, knn.index, knn.index.vectors, knn.product_ids, top_k,
+                                          catalog_exact_results, leave_one_out=True)
+        report['cascade'].append({'shortlist': shortlist, **cascade_report, 'catalog': catalog_report})
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark offline do pipeline: dataset/ como catálogo, '
+                                                 'dataset_test/ como consultas')
+    parser.add_argument('--config', default='{}', help='JSON mesclado sobre KNN_CONFIG, ex.: \'{"modo": "completo"}\'')
+    parser.add_argument('--step', type=int, default=1, help='usa uma a cada N imagens do dataset')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--index', choices=sorted(INDEX_BACKENDS), default=INDEX_EXACT)
+    parser.add_argument('--index-params', default='{}', help='JSON com os parâmetros do backend de índice')
+    parser.add_argument('--compare-texture', action='store_true',
+                        help='compara a textura padrão com CONFIG_TEXTURA_RAPIDA')
+    parser.add_argument('--compare-cascade', action='store_true',
+                        help='busca exata x cascata (histograma de cor + re-rank) para cada --shortlist')
+    parser.add_argument('--shortlist', type=int, nargs='+', default=list(CASCADE_SHORTLISTS))
+    parser.add_argument('--no-standardize', action='store_true',
+                        help='monta o índice com os vetores como extraídos, sem fit_scaler')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    config = {**KNN_CONFIG, **json.loads(args.config)}
+    if args.compare_cascade:
+        resultado = compare_cascade(config, args.step, args.workers, args.k, args.top_k, args.shortlist,
+                                    not args.no_standardize)
+    else:
+        benchmark = compare_texture if args.compare_texture else run
+        resultado = benchmark(config, args.step, args.workers, args.k, args.top_k, args.index,
+                              json.loads(args.index_params), not args.no_standardize)
+    texto = json.dumps(resultado, indent=2, default=str)
+    print(texto)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(texto)
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from bulk_loader import extract_features, EXTRACT_WORKERS
+from knn_process_image import KNN_CONFIG, ExactIndex, IVFIndex, PQIndex, fit_scaler, standardize
+from libs.knn_process import decodificar_entrada
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset')
+
+
+def list_dataset(path=DATASET_PATH, step=1):
+    files = []
+    for classe in sorted(os.listdir(path)):
+        pasta = os.path.join(path, classe)
+        if os.path.isdir(pasta):
+            files.extend((os.path.join(pasta, nome), classe) for nome in sorted(os.listdir(pasta)))
+    return files[::step]
+
+
+def read_image(path, config=KNN_CONFIG):
+    # Mesma decodificação da API e da carga do índice (reduzida pelo libjpeg quando possível).
+    with open(path, 'rb') as f:
+        return decodificar_entrada(f.read(), config)
+
+
+def load_dataset_features(path=DATASET_PATH, step=1, config=KNN_CONFIG, workers=EXTRACT_WORKERS, cache=None):
+    if cache and os.path.exists(cache):
+        with np.load(cache) as data:
+            return data['features'], data['labels']
+
+    files = list_dataset(path, step)
+    images = [read_image(arquivo, config) for arquivo, _ in files]
+    features = extract_features(images, config, workers)
+
+    valid = [i for i, f in enumerate(features) if f is not None]
+    features = np.vstack([features[i] for i in valid]).astype(np.float32)
+    labels = np.array([files[i][1] for i in valid])
+
+    if cache:
+        np.savez(cache, features=features, labels=labels)
+    return features, labels
+
+
+def percentiles_ms(latencies):
+    return {f'p{p}': round(float(np.percentile(latencies, p)) * 1000, 4) for p in (50, 95, 99)}
+
+
+def benchmark_index(index, base, queries, k, exact_results=None):
+    started_at = time.perf_counter()
+    index.build(base)
+    build_s = time.perf_counter() - started_at
+
+    results, latencies = [], []
+    for query in queries:
+        started_at = time.perf_counter()
+        results.append(index.query(query, k)[0][1])
+        latencies.append(time.perf_counter() - started_at)
+
+    arrays = index.to_arrays()
+    report = {'build_s': round(build_s, 4),  #
+              'latency_ms': percentiles_ms(latencies),  #
+              'bytes_per_item': {name: round(array.nbytes / len(index), 1) for name, array in arrays.items()}  #
+              }
+    if exact_results is not None:
+        hits = sum(len(np.intersect1d(r, e)) for r, e in zip(results, exact_results))
+        report['recall_at_k'] = round(hits / sum(len(e) for e in exact_results), 4)
+    return report, results
+
+
+def run(step=1, k=10, query_fraction=0.1, n_probes=(1, 2, 4, 8, 16), n_lists=None, workers=EXTRACT_WORKERS,
+        cache=None, seed=0, pq_subspaces=(20, 40, 80), pq_reranks=(0, 16, 64)):
+    features, labels = load_dataset_features(step=step, workers=workers, cache=cache)
+
+    rng = np.random.default_rng(seed)
+    is_query = rng.random(len(features)) < query_fraction
+    base, queries = features[~is_query], features[is_query]
+    # Mesma métrica servida pelo KNN: colunas padronizadas pelo scaler da base.
+    scaler = fit_scaler(base)
+    base, queries = standardize(base, scaler), standardize(queries, scaler)
+
+    report = {'n_base': int(len(base)), 'n_queries': int(len(queries)), 'dim': int(features.shape[1]), 'k': k}
+
+    report['exact'], exact_results = benchmark_index(ExactIndex(), base, queries, k)
+    report['ivf'] = []
+    for n_probe in n_probes:
+        ivf_report, _ = benchmark_index(IVFIndex(n_lists=n_lists, n_probe=n_probe, seed=seed), base, queries, k,
+                                        exact_results)
+        report['ivf'].append({'n_probe': n_probe, **ivf_report})
+
+    # Os códigos (n_subspaces bytes por item) são o que o PQ precisa manter residente.
+    report['pq'] = []
+    for n_subspaces in pq_subspaces:
+        for rerank in pq_reranks:
+            pq_report, _ = benchmark_index(PQIndex(n_subspaces=n_subspaces, rerank=rerank, seed=seed), base, queries, k,
+                                           exact_results)
+            report['pq'].append({'n_subspaces': n_subspaces, 'rerank': rerank, **pq_report})
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recall x latência dos backends de índice sobre dataset/')
+    parser.add_argument('--step', type=int, default=1, help='usa uma a cada N imagens do dataset')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--query-fraction', type=float, default=0.1)
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--n-lists', type=int, default=None)
+    parser.add_argument('--pq-subspaces', type=int, nargs='+', default=[20, 40, 80])
+    parser.add_argument('--pq-rerank', type=int, nargs='+', default=[0, 16, 64])
+    parser.add_argument('--workers', type=int, default=EXTRACT_WORKERS)
+    parser.add_argument('--cache', default=None, help='arquivo .npz para reaproveitar as features extraídas')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    resultado = run(args.step, args.k, args.query_fraction, args.n_probe, args.n_lists, args.workers, args.cache,
+                    pq_subspaces=args.pq_subspaces, pq_reranks=args.pq_rerank)
+    texto = json.dumps(resultado, indent=2)
+    print(texto)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(texto)
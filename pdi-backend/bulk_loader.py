@@ -0,0 +1,143 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import cv2
+
+from io_minio import get_many, MINIO_MAX_WORKERS
+from libs.knn_process import knn_process_df_image, concatenar_caracteristicas, decodificar_entrada
+
+FETCH_WORKERS = MINIO_MAX_WORKERS
+EXTRACT_WORKERS = os.cpu_count() or 1
+CHUNK_SIZE = 32
+PROGRESS_STEP = 0.1
+
+
+def init_extract_worker():
+    """
+    Inicializador dos processos de extração (initializer do ProcessPoolExecutor).
+    """
+    # Cada processo já é uma unidade de paralelismo; evita que o OpenCV dispare threads próprias.
+    cv2.setNumThreads(1)
+
+
+def _extract_chunk(images, config):
+    features = []
+    for image in images:
+        if image is None:
+            features.append(None)
+            continue
+        features.append(concatenar_caracteristicas(knn_process_df_image(image_process=image, config=config)))
+    return features
+
+
+def _read_image(file, config):
+    with open(file, 'rb') as f:
+        return decodificar_entrada(f.read(), config)
+
+
+def extract_files_chunk(files, config):
+    """
+    Args:
+        files: Caminhos das imagens do bloco
+        config: Config do pipeline
+
+    Returns:
+        list: Vetor de características de cada arquivo (None se não decodificou)
+    """
+    # Lê e decodifica no próprio processo do pool: só os caminhos atravessam o pickle.
+    return _extract_chunk([_read_image(file, config) for file in files], config)
+
+
+def _report_progress(stage, done, total, started_at, last_reported):
+    if total == 0 or (done < total and done / total - last_reported < PROGRESS_STEP):
+        return last_reported
+    print(f"[bulk_loader] {stage}: {done}/{total} ({done / total:.0%}) em {time.perf_counter() - started_at:.1f}s")
+    return done / total
+
+
+def fetch_images(paths, max_workers=FETCH_WORKERS, config=None):
+    # Download e decodificação reduzida nas threads de io_minio.get_many; objetos ausentes viram None.
+    return get_many(paths, max_workers=max_workers, decode=lambda data: decodificar_entrada(data, config))
+
+
+def extract_features(images, config=None, workers=EXTRACT_WORKERS, chunk_size=CHUNK_SIZE, executor=None,
+                     progress=True):
+    """
+    Args:
+        executor: ProcessPoolExecutor já aberto (com init_extract_worker), reaproveitado
+            entre chamadas; sem ele, um pool é criado só para esta chamada
+        progress: Imprime o andamento a cada PROGRESS_STEP
+    """
+    images = list(images)
+    chunks = [images[i:i + chunk_size] for i in range(0, len(images), chunk_size)]
+    started_at = time.perf_counter()
+
+    if workers <= 1 or len(chunks) <= 1:
+        features = _extract_chunk(images, config)
+        if progress:
+            _report_progress('extração', len(images), len(images), started_at, 0.0)
+        return features
+
+    results = [None] * len(chunks)
+    done = 0
+    last_reported = 0.0
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=init_extract_worker)
+    try:
+        futures = {executor.submit(_extract_chunk, chunk, config): i for i, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            done += len(chunks[i])
+            if progress:
+                last_reported = _report_progress('extração', done, len(images), started_at, last_reported)
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    return [feature for chunk in results for feature in chunk]
+
+
+def load_features(paths, config=None, fetch_workers=FETCH_WORKERS, extract_workers=EXTRACT_WORKERS,
+                  chunk_size=CHUNK_SIZE):
+    """
+    Baixa e extrai em blocos de extract_workers * chunk_size imagens: as imagens
+    decodificadas de um bloco são liberadas antes do download do próximo, então a
+    memória fica limitada a um bloco, não ao catálogo inteiro.
+
+    Returns:
+        tuple: (vetor de cada caminho ou None, tempos de download e extração em segundos)
+    """
+    paths = list(paths)
+    block_size = max(1, extract_workers) * chunk_size
+    timings = {'download': 0.0, 'extracao': 0.0}
+    features = []
+    started_at = time.perf_counter()
+    last_reported = 0.0
+
+    executor = ProcessPoolExecutor(max_workers=extract_workers, initializer=init_extract_worker) \
+        if extract_workers > 1 and len(paths) > chunk_size else None
+    try:
+        for start in range(0, len(paths), block_size):
+            block_started_at = time.perf_counter()
+            images = fetch_images(paths[start:start + block_size], fetch_workers, config)
+            timings['download'] += time.perf_counter() - block_started_at
+
+            block_started_at = time.perf_counter()
+            features.extend(extract_features(images, config, extract_workers, chunk_size, executor, progress=False))
+            timings['extracao'] += time.perf_counter() - block_started_at
+            del images
+
+            last_reported = _report_progress('carga', len(features), len(paths), started_at, last_reported)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    failed = sum(feature is None for feature in features)
+    print(f"[bulk_loader] {len(features)} imagens, {failed} falhas | download {timings['download']:.2f}s | "
+          f"extração {timings['extracao']:.2f}s ({extract_workers} processos)")
+
+    return features, timings
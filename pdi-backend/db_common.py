@@ -1,5 +1,12 @@
+import csv
+import io
+import threading
+
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text, insert, MetaData, Table, Column, BigInteger, String, Numeric, Date
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from metrics import timed
 
 POSTGRES_HOST = 'localhost'
 POSTGRES_PORT = 5432
@@ -7,28 +14,193 @@ POSTGRES_USER = 'admin'
 POSTGRES_PASSWORD = 'admin123'
 POSTGRES_DB = 'app_db'
 
+POOL_SIZE = 10
+POOL_MAX_OVERFLOW = 20
+POOL_TIMEOUT = 30
+POOL_RECYCLE = 1800
+ID_BLOCK_SIZE = 32
+
 engine = create_engine(
-    f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}")
+    f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}",
+    pool_size=POOL_SIZE,  #
+    max_overflow=POOL_MAX_OVERFLOW,  #
+    pool_timeout=POOL_TIMEOUT,  #
+    pool_recycle=POOL_RECYCLE,  #
+    pool_pre_ping=True  #
+)
+
+metadata = MetaData()
 
+TABLES = {'product': Table('product', metadata,  #
+                           Column('id_product', BigInteger, primary_key=True),  #
+                           Column('nm_product', String, nullable=False),  #
+                           Column('vl_product', Numeric, nullable=False)  #
+                           ),
+          'data': Table('data', metadata,  #
+                        Column('id_data', BigInteger, primary_key=True),  #
+                        Column('path_data', String, nullable=False),  #
+                        Column('tp_data', String, nullable=False),  #
+                        Column('dt_inclusion', Date, nullable=False)  #
+                        ),
+          'product_data': Table('product_data', metadata,  #
+                                Column('id_product_data', BigInteger, primary_key=True),  #
+                                Column('id_product', BigInteger, nullable=False),  #
+                                Column('id_data', BigInteger, nullable=False)  #
+                                )
+          }
 
-def __convert_dict__(data_list):
-    result = {}
 
-    for item in data_list:
-        for key, value in item.items():
-            if key not in result:
-                result[key] = []
-            result[key].append(value)
+def __rows__(data, need_convert):
+    if need_convert:
+        return list(data)
+    return [dict(zip(data, values)) for values in zip(*data.values())]
 
-    return result
 
+@timed('db_insert_data')
+def insert_data(table, data, need_convert=True, ignore_conflicts=False):
+    """
+    Insere as linhas num único executemany parametrizado.
+
+    Args:
+        table: Nome da tabela (product, data ou product_data)
+        data: Lista de dicts (need_convert=True) ou dict de listas (need_convert=False)
+        ignore_conflicts: ON CONFLICT DO NOTHING, para gravações repetidas com a mesma chave
+    """
+    rows = __rows__(data, need_convert)
+    if not rows:
+        return
+
+    statement = pg_insert(TABLES[table.lower()]).on_conflict_do_nothing() if ignore_conflicts \
+        else insert(TABLES[table.lower()])
+    with engine.begin() as conn:
+        conn.execute(statement, rows)
+
+
+@timed('db_insert_returning')
+def insert_returning(table, rows, returning, key):
+    """
+    INSERT ... VALUES (...), (...) RETURNING numa única ida ao banco; as chaves
+    omitidas vêm das sequences (BIGSERIAL). O Postgres não garante a ordem das
+    linhas do RETURNING, por isso cada valor volta associado à coluna key da linha.
+
+    Args:
+        returning: Coluna gerada a devolver (ex.: id_product)
+        key: Coluna que identifica a linha (ex.: nm_product, path_data)
+
+    Returns:
+        dict: Valor de key -> valor de returning
+    """
+    if not rows:
+        return {}
+
+    table = TABLES[table.lower()]
+    with engine.begin() as conn:
+        result = conn.execute(insert(table).values(list(rows)).returning(table.c[key], table.c[returning]))
+        return {row[0]: row[1] for row in result}
+
+
+@timed('db_fetch_all')
+def fetch_all(sql, params=None):
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(text(sql), params or {}).mappings()]
+
+
+@timed('db_fetch_one')
+def fetch_one(sql, params=None, commit=False):
+    """
+    Returns:
+        dict | None: Primeira linha do resultado. commit=True para instruções que
+        escrevem (ex.: INSERT ... RETURNING)
+    """
+    with (engine.begin() if commit else engine.connect()) as conn:
+        row = conn.execute(text(sql), params or {}).mappings().first()
+        return None if row is None else dict(row)
+
+
+@timed('db_copy_rows')
+def copy_rows(table, columns, rows):
+    """
+    Carga em massa via COPY ... FROM STDIN (CSV), para ingestões grandes.
+
+    Args:
+        table: Nome da tabela
+        columns: Colunas, na ordem dos valores de cada linha
+        rows: Iterável de tuplas/listas de valores
+
+    Returns:
+        int: Linhas copiadas
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(['\\N' if value is None else value for value in row])
+        count += 1
+    buffer.seek(0)
+
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.copy_expert(f"COPY {TABLES[table.lower()].name} ({', '.join(columns)}) "
+                               f"FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return count
+
+
+@timed('db_reserve_ids')
+def reserve_ids(table, count):
+    """
+    Returns:
+        list: count valores novos da sequence da chave primária da tabela
+    """
+    table = TABLES[table.lower()]
+    key = table.primary_key.columns.values()[0].name
+    with engine.connect() as conn:
+        return conn.execute(text("""
+        SELECT nextval(pg_get_serial_sequence(:table, :key)) FROM generate_series(1, :count)
+        """), {'table': table.name, 'key': key, 'count': count}).scalars().all()
+
+
+class SequenceBlock:
+    """
+    Entrega ids da sequence reservados em blocos de ID_BLOCK_SIZE, para a
+    requisição conhecer o id antes de a linha ser gravada. Ids não usados
+    (ex.: reinício do processo) viram lacunas na sequência.
+    """
+
+    def __init__(self, table, block_size=ID_BLOCK_SIZE):
+        self.table = table
+        self.block_size = block_size
+        self.free = []
+        self.lock = threading.Lock()
+
+    def next(self, count=1):
+        with self.lock:
+            if len(self.free) < count:
+                self.free.extend(reserve_ids(self.table, max(self.block_size, count - len(self.free))))
+            ids, self.free = self.free[:count], self.free[count:]
+            return [int(i) for i in ids]
 
-def insert_data(table, data, need_convert=True):
-    if need_convert:
-        data = __convert_dict__(data)
 
-    pd.DataFrame(data).to_sql(table.lower(), engine, if_exists="append", index=False)
+def sync_sequences():
+    """
+    Acerta as sequences depois de cargas com ids explícitos (notebooks de setup,
+    copy_rows com a coluna de id), para que o próximo nextval não colida.
+    """
+    with engine.begin() as conn:
+        for name, table in TABLES.items():
+            key = table.primary_key.columns.values()[0].name
+            conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{name}', '{key}'), "
+                              f"COALESCE(MAX({key}), 0) + 1, false) FROM {name}"))
 
 
-def select_data(sql):
-    return pd.read_sql(sql, engine)
+@timed('db_select_data')
+def select_data(sql, params=None):
+    # DataFrame para cargas e análises fora do caminho da requisição (índice, notebooks).
+    return pd.read_sql(text(sql), engine, params=params)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from io_minio import get_parquet_minio, upload_parquet
+
+SNAPSHOT_PREFIX = 'knn-features'
+
+
+def snapshot_key(config_hash):
+    return f'{SNAPSHOT_PREFIX}/{config_hash}.parquet'
+
+
+def load_feature_snapshot(config_hash):
+    df_snapshot = get_parquet_minio(snapshot_key(config_hash))
+
+    if df_snapshot is None or df_snapshot.attrs.get('config_hash') != config_hash:
+        return None
+
+    df_snapshot.attrs.setdefault('watermark', int(df_snapshot['id_data'].max()) if len(df_snapshot) else 0)
+    return df_snapshot
+
+
+def snapshot_scaler(df_snapshot):
+    """
+    Returns:
+        dict | None: mean e std com que o índice foi padronizado (knn_process_image.fit_scaler)
+    """
+    if df_snapshot is None or 'scaler_mean' not in df_snapshot.attrs:
+        return None
+    return {'mean': np.asarray(df_snapshot.attrs['scaler_mean'], dtype=np.float32),  #
+            'std': np.asarray(df_snapshot.attrs['scaler_std'], dtype=np.float32)  #
+            }
+
+
+def save_feature_snapshot(config_hash, id_data, features, scaler=None):
+    """
+    Args:
+        features: Vetores como extraídos, sem padronizar
+        scaler: mean e std do índice montado com esses vetores, gravados junto
+    """
+    df_snapshot = pd.DataFrame({'id_data': np.asarray(id_data, dtype=np.int64),  #
+                                'features': [np.asarray(f, dtype=np.float32) for f in features]  #
+                                })
+    df_snapshot.attrs['config_hash'] = config_hash
+    df_snapshot.attrs['watermark'] = int(df_snapshot['id_data'].max()) if len(df_snapshot) else 0
+    if scaler is not None:
+        df_snapshot.attrs['scaler_mean'] = np.asarray(scaler['mean'], dtype=np.float32).tolist()
+        df_snapshot.attrs['scaler_std'] = np.asarray(scaler['std'], dtype=np.float32).tolist()
+
+    upload_parquet(df_snapshot, snapshot_key(config_hash))
+    return df_snapshot
@@ -0,0 +1,17 @@
+import os
+
+from index_store import INDEX_STORE_PATH, current_version, publish
+
+# gunicorn -c gunicorn.conf.py api:app, com INDEX_STORE_PATH apontando para um diretório local.
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 120
+
+
+def on_starting(server):
+    # Constrói a primeira versão antes do fork; os workers só anexam o índice publicado.
+    # Versões seguintes vêm de `python index_store.py --watch N` rodando à parte.
+    if INDEX_STORE_PATH and current_version(INDEX_STORE_PATH) is None:
+        from knn_process_image import KNN
+        publish(KNN(), INDEX_STORE_PATH)
@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+# Formato .pdi (little-endian):
+#
+#     magic (8 bytes) | versão do formato (uint32) | tamanho do cabeçalho (uint32)
+#     cabeçalho JSON (utf-8), completado com espaços até múltiplo de SECTION_ALIGN
+#     seções contíguas, cada uma começando num offset múltiplo de SECTION_ALIGN
+#
+# O cabeçalho traz config_hash, kind, params, dtype, rows, dim, o catálogo de
+# produtos, o sha256 da região de dados e, para cada seção, offset, dtype e shape.
+# Ler o arquivo é só interpretar o cabeçalho e abrir cada seção como np.memmap.
+MAGIC = b'PDIINDEX'
+FORMAT_VERSION = 1
+SECTION_ALIGN = 64
+CHUNK_SIZE = 16 * 1024 * 1024
+_PREFIX = struct.Struct('<8sII')
+
+
+def __align__(offset):
+    return -(-offset // SECTION_ALIGN) * SECTION_ALIGN
+
+
+def __encode_paths__(path_data):
+    if isinstance(path_data, np.ndarray) and path_data.dtype.kind == 'S':
+        return path_data
+    return np.array([p if isinstance(p, bytes) else str(p).encode('utf-8') for p in path_data], dtype=bytes)
+
+
+def __sections__(index, id_data, id_product, path_data, scaler):
+    sections = {**index.to_arrays(),  #
+                'id_data': np.asarray(id_data, dtype='<i8'),  #
+                'id_product': np.asarray(id_product, dtype='<i8'),  #
+                'path_data': __encode_paths__(path_data)  #
+                }
+    if scaler is not None:
+        sections['scaler_mean'] = np.asarray(scaler['mean'], dtype='<f4')
+        sections['scaler_std'] = np.asarray(scaler['std'], dtype='<f4')
+    return sections
+
+
+def write_index(path, index, id_data, id_product, path_data, config_hash, catalog=None, checksum=True,
+                scaler=None):
+    """
+    Grava o índice num único arquivo .pdi.
+
+    Args:
+        index: ExactIndex ou IVFIndex já construído
+        id_data, id_product, path_data: Metadados alinhados às linhas do índice
+        config_hash: hash_pipeline_config da configuração que gerou os vetores
+        catalog: dict id_product -> {nm_product, vl_product}
+        checksum: Calcula o sha256 da região de dados (verificável com verify=True)
+        scaler: mean e std com que os vetores do índice foram padronizados (seções
+            scaler_mean e scaler_std), aplicados também às consultas
+
+    Returns:
+        dict: Cabeçalho gravado
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in
+              __sections__(index, id_data, id_product, path_data, scaler).items()}
+
+    sections, offset = {}, 0
+    for name, array in arrays.items():
+        if array.dtype.kind in 'fiu':
+            array = arrays[name] = array.astype(array.dtype.newbyteorder('<'), copy=False)
+        sections[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset = __align__(offset + array.nbytes)
+
+    digest = None
+    if checksum:
+        sha = hashlib.sha256()
+        for name, array in arrays.items():
+            sha.update(array.tobytes())
+            sha.update(b'\0' * (__align__(array.nbytes) - array.nbytes))
+        digest = sha.hexdigest()
+
+    header = {'config_hash': config_hash,  #
+              'kind': index.kind,  #
+              'params': index.params(),  #
+              'dtype': arrays['vectors'].dtype.str,  #
+              'rows': len(index),  #
+              'dim': index.dim,  #
+              'sections': sections,  #
+              'data_size': offset,  #
+              'sha256': digest,  #
+              'catalog': {str(k): v for k, v in (catalog or {}).items()},  #
+              'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')  #
+              }
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (__align__(_PREFIX.size + len(header_bytes)) - _PREFIX.size - len(header_bytes))
+
+    with open(path, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.write(array.tobytes())
+            f.write(b'\0' * (__align__(array.nbytes) - array.nbytes))
+        f.flush()
+        os.fsync(f.fileno())
+
+    return header
+
+
+def read_header(path):
+    """
+    Returns:
+        tuple: (cabeçalho, offset do início da região de dados)
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError(f"Arquivo de índice truncado: {path}")
+        magic, format_version, header_size = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"{path} não é um arquivo de índice .pdi")
+        if format_version != FORMAT_VERSION:
+            raise ValueError(f"Versão de formato {format_version} não suportada (esperado {FORMAT_VERSION})")
+        header = json.loads(f.read(header_size).decode('utf-8'))
+
+    data_offset = _PREFIX.size + header_size
+    if os.path.getsize(path) < data_offset + header['data_size']:
+        raise ValueError(f"Arquivo de índice truncado: {path}")
+    return header, data_offset
+
+
+def verify_index(path):
+    """
+    Confere o sha256 da região de dados.
+
+    Raises:
+        ValueError: Arquivo sem checksum ou com conteúdo divergente
+    """
+    header, data_offset = read_header(path)
+    if not header['sha256']:
+        raise ValueError(f"{path} foi gravado sem checksum")
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(data_offset)
+        remaining = header['data_size']
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            sha.update(chunk)
+            remaining -= len(chunk)
+
+    if sha.hexdigest() != header['sha256']:
+        raise ValueError(f"Checksum divergente em {path}")
+    return header
+
+
+def read_index(path, verify=False):
+    """
+    Abre o arquivo .pdi sem copiar os dados: cada seção vira um np.memmap somente leitura.
+
+    Returns:
+        tuple: (cabeçalho, arrays, catálogo)
+    """
+    if verify:
+        verify_index(path)
+    header, data_offset = read_header(path)
+
+    arrays = {}
+    for name, section in header['sections'].items():
+        shape = tuple(section['shape'])
+        if 0 in shape:
+            arrays[name] = np.empty(shape, dtype=section['dtype'])
+            continue
+        arrays[name] = np.memmap(path, dtype=np.dtype(section['dtype']), mode='r',
+                                 offset=data_offset + section['offset'], shape=shape)
+
+    catalog = {int(k): v for k, v in header['catalog'].items()}
+    return header, arrays, catalog
+
+
+def decode_path(path):
+    # Caminhos da seção path_data são bytes de largura fixa; os que vieram do banco já são str.
+    return path.decode('utf-8') if isinstance(path, bytes) else path
+
+
+def __summary__(header, path):
+    return {'path': path,  #
+            'size_mb': round(os.path.getsize(path) / 1024 ** 2, 2),  #
+            **{k: header[k] for k in ('config_hash', 'kind', 'params', 'dtype', 'rows', 'dim', 'sha256', 'created_at')},
+            'products': len(header['catalog']),  #
+            'sections': header['sections']  #
+            }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Arquivo de índice .pdi: constrói, inspeciona e verifica')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='carrega o KNN (Postgres/MinIO) e grava o arquivo')
+    build_parser.add_argument('output')
+    build_parser.add_argument('--index', default=None, help='backend de índice (exact, ivf)')
+    build_parser.add_argument('--index-params', default='{}', help='JSON com os parâmetros do backend')
+    build_parser.add_argument('--no-checksum', action='store_true')
+
+    inspect_parser = subparsers.add_parser('inspect', help='mostra o cabeçalho')
+    inspect_parser.add_argument('path')
+
+    verify_parser = subparsers.add_parser('verify', help='confere o checksum')
+    verify_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from knn_process_image import KNN, INDEX_EXACT
+
+        started_at = time.perf_counter()
+        knn = KNN(index_backend=args.index or INDEX_EXACT, index_params=json.loads(args.index_params))
+        knn.save_index_file(args.output, checksum=not args.no_checksum)
+        print(json.dumps({**__summary__(read_header(args.output)[0], args.output),
+                          'build_s': round(time.perf_counter() - started_at, 2)}, indent=2))
+
+    elif args.command == 'inspect':
+        started_at = time.perf_counter()
+        header, _, _ = read_index(args.path)
+        print(json.dumps({**__summary__(header, args.path),
+                          'open_ms': round((time.perf_counter() - started_at) * 1000, 3)}, indent=2))
+
+    elif args.command == 'verify':
+        started_at = time.perf_counter()
+        try:
+            verify_index(args.path)
+        except ValueError as e:
+            print(f"Falha: {e}")
+            raise SystemExit(1)
+        print(f"OK: checksum confere ({time.perf_counter() - started_at:.2f}s)")
@@ -0,0 +1,87 @@
+import argparse
+import os
+import time
+
+# Diretório compartilhado pelos workers de produção:
+#
+#     <root>/CURRENT          nome da versão ativa (trocado com os.replace)
+#     <root>/<versão>.pdi     índice completo no formato de index_file.py
+#
+# Cada versão é escrita num arquivo temporário e renomeada antes de o CURRENT
+# apontar para ela; os workers abrem as seções com np.memmap, então o page cache
+# do sistema guarda uma única cópia da matriz para todos eles.
+INDEX_STORE_PATH = os.environ.get('INDEX_STORE_PATH')
+INDEX_KEEP_VERSIONS = 3
+INDEX_POLL_SECONDS = 5
+CURRENT_FILE = 'CURRENT'
+VERSION_SUFFIX = '.pdi'
+
+
+def current_version(root=INDEX_STORE_PATH):
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_path(version, root=INDEX_STORE_PATH):
+    return os.path.join(root, f'{version}{VERSION_SUFFIX}')
+
+
+def list_versions(root=INDEX_STORE_PATH):
+    if not os.path.isdir(root):
+        return []
+    return sorted(name[:-len(VERSION_SUFFIX)] for name in os.listdir(root)
+                  if not name.startswith('.') and name.endswith(VERSION_SUFFIX))
+
+
+def publish(knn, root=INDEX_STORE_PATH, keep=INDEX_KEEP_VERSIONS):
+    """
+    Grava o índice carregado no KNN como nova versão e a torna a atual.
+
+    Returns:
+        str: Nome da versão publicada
+    """
+    version = f"{time.strftime('%Y%m%d%H%M%S')}{time.time_ns() // 1000 % 1000000:06d}-{knn.config_hash}"
+
+    os.makedirs(root, exist_ok=True)
+    tmp_path = os.path.join(root, f'.tmp-{version}{VERSION_SUFFIX}')
+    header = knn.save_index_file(tmp_path)
+    os.rename(tmp_path, version_path(version, root))
+
+    tmp_current = os.path.join(root, f'.{CURRENT_FILE}.{os.getpid()}')
+    with open(tmp_current, 'w') as f:
+        f.write(version)
+    os.replace(tmp_current, os.path.join(root, CURRENT_FILE))
+
+    prune(root, keep)
+    print(f"[index_store] Versão {version} publicada: {header['rows']} vetores, dim {header['dim']}")
+    return version
+
+
+def prune(root=INDEX_STORE_PATH, keep=INDEX_KEEP_VERSIONS):
+    # Workers ainda presos a uma versão removida seguem lendo: o mmap mantém o arquivo vivo até fechar.
+    active = current_version(root)
+    for version in list_versions(root)[:-keep]:
+        if version != active:
+            try:
+                os.remove(version_path(version, root))
+            except FileNotFoundError:
+                pass
+
+
+if __name__ == '__main__':
+    from knn_process_image import KNN
+
+    parser = argparse.ArgumentParser(description='Constrói e publica o índice compartilhado pelos workers')
+    parser.add_argument('--root', default=INDEX_STORE_PATH, required=INDEX_STORE_PATH is None)
+    parser.add_argument('--keep', type=int, default=INDEX_KEEP_VERSIONS)
+    parser.add_argument('--watch', type=float, default=None, help='republica a cada N segundos')
+    args = parser.parse_args()
+
+    while True:
+        publish(KNN(), args.root, args.keep)
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
@@ -0,0 +1,259 @@
+import argparse
+import datetime
+import glob
+import json
+import mimetypes
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bulk_loader import extract_files_chunk, init_extract_worker, EXTRACT_WORKERS, CHUNK_SIZE
+from common import allowed_file
+from db_common import fetch_all, insert_returning, copy_rows, reserve_ids, sync_sequences
+from feature_store import load_feature_snapshot, save_feature_snapshot
+from io_minio import put_many, MINIO_MAX_WORKERS
+from knn_process_image import KNN_CONFIG
+from libs.knn_process import hash_pipeline_config
+from result_cache import content_key
+
+DATASET_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset'))
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ingest_checkpoint')
+DONE_FILE = 'done.jsonl'
+BATCH_SIZE = 256
+# Chave do objeto derivada do conteúdo: reenviar o mesmo arquivo após uma interrupção não cria outro objeto.
+# Truncada no mesmo tamanho de common.generate_hash, o que mantém válidas as chaves de cargas anteriores.
+OBJECT_KEY_LENGTH = 25
+
+
+def scan_dataset(root):
+    """
+    Returns:
+        list: (classe, caminho relativo) de cada imagem, uma pasta por classe
+    """
+    files = []
+    for name in sorted(os.listdir(root)):
+        class_dir = os.path.join(root, name)
+        if not os.path.isdir(class_dir):
+            continue
+        files.extend((name, os.path.join(name, file)) for file in sorted(os.listdir(class_dir))
+                     if allowed_file(file) and os.path.isfile(os.path.join(class_dir, file)))
+    return files
+
+
+def upsert_products(names):
+    """
+    Cria os produtos que ainda não existem (preço aleatório entre 5 e 20, como
+    no setup_api_1.ipynb).
+
+    Returns:
+        dict: nm_product -> id_product
+    """
+    products = {row['nm_product']: int(row['id_product']) for row in fetch_all("""
+    SELECT p.id_product, p.nm_product FROM product p WHERE p.nm_product = ANY(:names)
+    """, {'names': list(names)})}
+
+    missing = [name for name in names if name not in products]
+    ids = insert_returning('product', [{'nm_product': name, 'vl_product': round(5 + random.random() * 15, 2)}
+                                       for name in missing], 'id_product', 'nm_product')
+    products.update((name, int(id_product)) for name, id_product in ids.items())
+    if missing:
+        print(f"[ingest] {len(missing)} produtos novos")
+    return products
+
+
+def load_done(checkpoint_dir):
+    done = set()
+    path = os.path.join(checkpoint_dir, DONE_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    done.add(json.loads(line)['file'])
+    return done
+
+
+def mark_done(checkpoint_dir, entries):
+    with open(os.path.join(checkpoint_dir, DONE_FILE), 'a') as f:
+        f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def __existing__(keys):
+    # Linhas gravadas por uma execução interrompida entre o COPY e o checkpoint.
+    existing = {}
+    for row in fetch_all("""
+    SELECT d.id_data, d.path_data, pd.id_product FROM data d
+    LEFT JOIN product_data pd ON pd.id_data = d.id_data
+    WHERE d.path_data = ANY(:keys)
+    """, {'keys': list(keys)}):
+        entry = existing.setdefault(row['path_data'], {'id_data': int(row['id_data']), 'products': set()})
+        if row['id_product'] is not None:
+            entry['products'].add(int(row['id_product']))
+    return existing
+
+
+def ingest_batch(root, batch, products, upload_workers):
+    """
+    Envia e grava um lote de imagens.
+
+    Args:
+        batch: Lista de (classe, caminho relativo)
+
+    Returns:
+        tuple: (entradas gravadas {file, id_data, id_product}, quantidade de falhas, bytes enviados)
+    """
+    items = []
+    for name, file in batch:
+        with open(os.path.join(root, file), 'rb') as f:
+            data = f.read()
+        items.append({'file': file, 'id_product': products[name], 'key': content_key(data)[:OBJECT_KEY_LENGTH],  #
+                      'data': data})
+
+    existing = __existing__({item['key'] for item in items})
+    new_items = {}
+    for item in items:
+        if item['key'] not in existing and item['key'] not in new_items:
+            new_items[item['key']] = item
+
+    results = put_many([(key, item['data'], mimetypes.guess_type(item['file'])[0] or 'application/octet-stream')
+                        for key, item in new_items.items()], max_workers=upload_workers) if new_items else []
+    failed_keys = {key for key, error in zip(new_items, results) if error is not None}
+    for key, error in zip(new_items, results):
+        if error is not None:
+            print(f"[ingest] Erro ao enviar {new_items[key]['file']}: {error}")
+
+    uploaded = [key for key in new_items if key not in failed_keys]
+    ids = reserve_ids('data', len(uploaded)) if uploaded else []
+    today = datetime.date.today()
+    copy_rows('data', ['id_data', 'path_data', 'tp_data', 'dt_inclusion'],
+              [(int(id_data), key, 'IMG', today) for id_data, key in zip(ids, uploaded)])
+    for id_data, key in zip(ids, uploaded):
+        existing[key] = {'id_data': int(id_data), 'products': set()}
+
+    entries, links = [], []
+    for item in items:
+        if item['key'] in failed_keys:
+            continue
+        entry = existing[item['key']]
+        if item['id_product'] not in entry['products']:
+            entry['products'].add(item['id_product'])
+            links.append((item['id_product'], entry['id_data']))
+        entries.append({'file': item['file'], 'id_data': entry['id_data'], 'id_product': item['id_product']})
+    copy_rows('product_data', ['id_product', 'id_data'], links)
+
+    return entries, len(batch) - len(entries), sum(len(new_items[key]['data']) for key in uploaded)
+
+
+def merge_features(checkpoint_dir, config_hash):
+    """
+    Junta os lotes de características do checkpoint ao snapshot do feature_store.
+
+    Returns:
+        int: Vetores no snapshot
+    """
+    parts = sorted(glob.glob(os.path.join(checkpoint_dir, f'features-{config_hash}-*.npz')))
+    if not parts:
+        return 0
+
+    df_snapshot = load_feature_snapshot(config_hash)
+    features_by_id = {} if df_snapshot is None else dict(zip(df_snapshot['id_data'].tolist(),
+                                                             df_snapshot['features']))
+    for part in parts:
+        with np.load(part) as data:
+            features_by_id.update(zip(data['id_data'].tolist(), data['features']))
+
+    save_feature_snapshot(config_hash, list(features_by_id), list(features_by_id.values()))
+    for part in parts:
+        os.remove(part)
+    return len(features_by_id)
+
+
+def ingest(root=DATASET_PATH, checkpoint_dir=CHECKPOINT_DIR, batch_size=BATCH_SIZE, upload_workers=MINIO_MAX_WORKERS,
+           extract_workers=EXTRACT_WORKERS, features=True, config=KNN_CONFIG):
+    """
+    Carrega o dataset (uma pasta por produto) no MinIO e no Postgres. Cada lote
+    concluído é registrado em checkpoint_dir/done.jsonl; uma nova execução
+    continua de onde a anterior parou.
+
+    Returns:
+        dict: Contagens e vazão (imagens/s)
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    config_hash = hash_pipeline_config(config)
+    started_at = time.perf_counter()
+
+    files = scan_dataset(root)
+    done = load_done(checkpoint_dir)
+    pending = [(name, file) for name, file in files if file not in done]
+    print(f"[ingest] {len(files)} imagens em {root}: {len(files) - len(pending)} já concluídas, "
+          f"{len(pending)} pendentes")
+
+    # Cargas antigas com ids explícitos (notebooks) deixam as sequences para trás.
+    sync_sequences()
+    products = upsert_products(sorted({name for name, _ in pending})) if pending else {}
+
+    stats = {'images': 0, 'failed': 0, 'bytes': 0, 'features': 0}
+    executor = ProcessPoolExecutor(max_workers=max(1, extract_workers), initializer=init_extract_worker) \
+        if features and pending else None
+    try:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            batch_started_at = time.perf_counter()
+
+            # Extração nos processos em paralelo com envio e COPY da thread principal.
+            paths = [os.path.join(root, file) for _, file in batch]
+            futures = [executor.submit(extract_files_chunk, paths[i:i + CHUNK_SIZE], config)
+                       for i in range(0, len(paths), CHUNK_SIZE)] if executor else []
+
+            entries, failed, sent = ingest_batch(root, batch, products, upload_workers)
+
+            if futures:
+                vectors = [vector for future in futures for vector in future.result()]
+                by_file = dict(zip((file for _, file in batch), vectors))
+                pairs = [(entry['id_data'], by_file[entry['file']]) for entry in entries
+                         if by_file[entry['file']] is not None]
+                if pairs:
+                    np.savez(os.path.join(checkpoint_dir, f'features-{config_hash}-{time.time_ns()}.npz'),
+                             id_data=np.asarray([p[0] for p in pairs], dtype=np.int64),
+                             features=np.vstack([p[1] for p in pairs]).astype(np.float32))
+                stats['features'] += len(pairs)
+
+            mark_done(checkpoint_dir, entries)
+            stats['images'] += len(entries)
+            stats['failed'] += failed
+            stats['bytes'] += sent
+
+            elapsed = time.perf_counter() - started_at
+            batch_rate = len(batch) / (time.perf_counter() - batch_started_at)
+            print(f"[ingest] {start + len(batch)}/{len(pending)} | lote {batch_rate:.1f} img/s | "
+                  f"total {stats['images'] / elapsed:.1f} img/s, {stats['bytes'] / 1024 ** 2 / elapsed:.1f} MB/s")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if features:
+        stats['snapshot'] = merge_features(checkpoint_dir, config_hash)
+
+    elapsed = time.perf_counter() - started_at
+    stats.update({'seconds': round(elapsed, 2), 'images_per_s': round(stats['images'] / elapsed, 1) if elapsed else 0})
+    print(f"[ingest] Concluído: {stats['images']} imagens, {stats['failed']} falhas em {elapsed:.1f}s "
+          f"({stats['images_per_s']} img/s)")
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Carga do dataset (uma pasta por produto) no MinIO e no Postgres')
+    parser.add_argument('dataset', nargs='?', default=DATASET_PATH)
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--upload-workers', type=int, default=MINIO_MAX_WORKERS)
+    parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS)
+    parser.add_argument('--no-features', action='store_true', help='não calcula o snapshot de características')
+    args = parser.parse_args()
+
+    print(json.dumps(ingest(args.dataset, args.checkpoint_dir, args.batch_size, args.upload_workers,
+                            args.extract_workers, not args.no_features), indent=2))
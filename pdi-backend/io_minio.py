@@ -1,70 +1,164 @@
 import io
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import numpy as np
 import boto3
 import cv2
-from botocore.exceptions import ClientError
-import io
-import boto3
+import numpy as np
+import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
+from botocore.config import Config
 from botocore.exceptions import ClientError
+
 from common import generate_hash
-import mimetypes
-import pandas as pd
-from botocore.exceptions import ClientError
-from io import BytesIO
+from metrics import timed
+
+MINIO_POOL_SIZE = 32
+MINIO_MAX_WORKERS = 16
+# Diretório local usado no lugar do MinIO (desenvolvimento e testes sem o serviço).
+OBJECT_STORE_PATH = os.environ.get('OBJECT_STORE_PATH')
+
+
+class FilesystemClient:
+    """
+    Subconjunto da API do cliente boto3 (head_bucket, create_bucket, put_object,
+    get_object) sobre um diretório local: um subdiretório por bucket, um arquivo
+    por objeto.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def __path__(self, bucket, key=''):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def head_bucket(self, Bucket):
+        if not os.path.isdir(self.__path__(Bucket)):
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadBucket')
+
+    def create_bucket(self, Bucket):
+        os.makedirs(self.__path__(Bucket), exist_ok=True)
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        path = self.__path__(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(Body)
+        os.replace(tmp_path, path)
+
+    def get_object(self, Bucket, Key):
+        try:
+            with open(self.__path__(Bucket, Key), 'rb') as f:
+                return {'Body': io.BytesIO(f.read())}
+        except FileNotFoundError:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+
+
+if OBJECT_STORE_PATH:
+    minio_client = FilesystemClient(OBJECT_STORE_PATH)
+else:
+    minio_client = boto3.client(service_name="s3",  #
+                                endpoint_url="http://localhost:9090",  #
+                                aws_access_key_id="admin",  #
+                                aws_secret_access_key="admin123",  #
+                                config=Config(max_pool_connections=MINIO_POOL_SIZE,  #
+                                              retries={'max_attempts': 3, 'mode': 'standard'})  #
+                                )
+
+_ensured_buckets = set()
+_ensured_buckets_lock = threading.Lock()
 
-minio_client = boto3.client(service_name="s3",  #
-                            endpoint_url="http://localhost:9090",  #
-                            aws_access_key_id="admin",  #
-                            aws_secret_access_key="admin123"  #
-                            )
 
 def ensure_bucket(bucket_name: str):
-    try:
-        minio_client.head_bucket(Bucket=bucket_name)
-    except ClientError:
-        minio_client.create_bucket(Bucket=bucket_name)
+    # Verificado uma vez por processo; buckets não são apagados com a aplicação no ar.
+    if bucket_name in _ensured_buckets:
+        return
+
+    with _ensured_buckets_lock:
+        if bucket_name in _ensured_buckets:
+            return
+        try:
+            minio_client.head_bucket(Bucket=bucket_name)
+        except ClientError:
+            minio_client.create_bucket(Bucket=bucket_name)
+        _ensured_buckets.add(bucket_name)
 
 
 def upload_img_path(image_path, key=None):
-    image = cv2.imread(image_path)
     content_type, _ = mimetypes.guess_type(image_path)
-    return upload_img(image, content_type, key)
+    with open(image_path, 'rb') as f:
+        return upload_img(None, content_type, key, image_bytes=f.read())
 
-def upload_img(image, content_type, key=None):
-    bucket_name = 'dataset'
-    ensure_bucket(bucket_name)
-    
+
+@timed('minio_upload_img')
+def upload_img(image, content_type, key=None, image_bytes=None):
+    """
+    Args:
+        image: Imagem decodificada; só é recodificada quando image_bytes não vem
+        image_bytes: Bytes originais do arquivo, enviados sem recodificar
+
+    Returns:
+        str: Chave do objeto
+    """
     if not key:
         key = generate_hash(content_type)
-    
-    _, extension = content_type.split('/')
-    _, buffer = cv2.imencode(f".{extension}", image)
-    image_bytes = io.BytesIO(buffer)
 
+    if image_bytes is None:
+        _, extension = content_type.split('/')
+        _, buffer = cv2.imencode(f".{extension}", image)
+        image_bytes = buffer.tobytes()
+
+    put_bytes(image_bytes, key, content_type)
+    return key
+
+
+def put_bytes(data, key, content_type='application/octet-stream', bucket_name='dataset'):
+    ensure_bucket(bucket_name)
     minio_client.put_object(Bucket=bucket_name,  #
                             Key=key,  #
-                            Body=image_bytes.getvalue(),  #
+                            Body=data,  #
                             ContentType=content_type  #
                             )
 
-def upload_parquet(df, key):
-    bucket_name = 'dataset-parquet'
+
+@timed('minio_put_many')
+def put_many(items, bucket_name='dataset', max_workers=MINIO_MAX_WORKERS):
+    """
+    Envia vários objetos em paralelo, com no máximo max_workers requisições simultâneas.
+
+    Args:
+        items: Iterável de (key, data, content_type)
+
+    Returns:
+        list: None para cada envio bem-sucedido ou a exceção levantada, na ordem de items
+    """
+    items = list(items)
     ensure_bucket(bucket_name)
-    
+
+    def put(item):
+        key, data, content_type = item
+        try:
+            put_bytes(data, key, content_type, bucket_name)
+            return None
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        return list(executor.map(put, items))
+
+
+@timed('minio_upload_parquet')
+def upload_parquet(df, key):
     buffer = io.BytesIO()
     pq.write_table(pa.Table.from_pandas(df), buffer)
-    buffer.seek(0)
-    
-    minio_client.put_object(
-        Bucket=bucket_name, #
-        Key=key, #
-        Body=buffer.getvalue(), #
-        ContentType='application/octet-stream' 
-    )
+    put_bytes(buffer.getvalue(), key, 'application/octet-stream', 'dataset-parquet')
+
 
+@timed('minio_get_image')
 def get_image_minio(object_name, bucket_name='dataset'):
     try:
         response = minio_client.get_object(Bucket=bucket_name, Key=object_name)
@@ -82,15 +176,54 @@ def get_image_minio(object_name, bucket_name='dataset'):
             print(f"Erro ao baixar objeto: {e}")
         return None
 
+
+def decode_img(file_data):
+    if file_data is None:
+        return None
+    return cv2.imdecode(np.frombuffer(file_data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def get_single_object_img(object_name, bucket_name='dataset'):
+    return decode_img(get_image_minio(object_name, bucket_name))
+
+
+@timed('minio_get_many')
+def get_many(object_names, bucket_name='dataset', max_workers=MINIO_MAX_WORKERS, decode=False):
+    """
+    Baixa vários objetos em paralelo, com no máximo max_workers requisições simultâneas.
+
+    Args:
+        decode: True decodifica cada objeto com decode_img; uma função recebe os
+            bytes e decodifica à sua maneira (ex.: libs.knn_process.decodificar_entrada),
+            também nas threads do download
+
+    Returns:
+        list: Bytes (ou imagem decodificada, com decode) de cada objeto, None
+        para os ausentes, na ordem de object_names
+    """
+    object_names = list(object_names)
+    if not object_names:
+        return []
+    decode = decode_img if decode is True else decode
+
+    def fetch(name):
+        data = get_image_minio(name, bucket_name)
+        return data if not decode or data is None else decode(data)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(object_names)))) as executor:
+        return list(executor.map(fetch, object_names))
+
+
+@timed('minio_get_parquet')
 def get_parquet_minio(object_name, bucket_name='dataset-parquet'):
     try:
         response = minio_client.get_object(Bucket=bucket_name, Key=object_name)
         file_data = response['Body'].read()
         response['Body'].close()
 
-        buffer = BytesIO(file_data)
+        buffer = io.BytesIO(file_data)
         return pd.read_parquet(buffer, engine='pyarrow')
-    
+
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == 'NoSuchKey':
@@ -101,4 +234,4 @@ def get_parquet_minio(object_name, bucket_name='dataset-parquet'):
 
     except Exception as e:
         print(f"Erro inesperado ao processar '{object_name}': {e}")
-        return None
\ No newline at end of file
+        return None
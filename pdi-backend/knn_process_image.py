@@ -1,76 +1,934 @@
+import copy
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 import pandas as pd
-from sklearn.neighbors import NearestNeighbors
 
-from db_common import select_data
-from io_minio import get_single_object_img
-from libs.knn_process import knn_process_df_image
+from bulk_loader import load_features, EXTRACT_WORKERS
+from db_common import select_data, fetch_all
+from feature_store import load_feature_snapshot, save_feature_snapshot, snapshot_scaler
+from index_file import read_index, write_index, decode_path
+from index_store import current_version, version_path, INDEX_POLL_SECONDS
+from libs.knn_process import knn_process_df_image, hash_pipeline_config, concatenar_caracteristicas, \
+    ajustar_tamanho_vetor, dimensao_histograma_cor, MODO_DESCRITOR
+from metrics import timed
+from result_cache import ResultCache
 
+KNN_CONFIG = {'modo': MODO_DESCRITOR}
+DELTA_REFIT_THRESHOLD = 256
+MAX_PENDING_VECTORS = 1024
+KNN_NEIGHBORS = 10
+TOP_PRODUCTS = 3
+BATCH_WORKERS = 8
+VOTE_MAJORITY = 'majority'
+VOTE_DISTANCE = 'distance'
+INDEX_EXACT = 'exact'
+INDEX_IVF = 'ivf'
+INDEX_PQ = 'pq'
+INDEX_CASCADE = 'cascade'
+METADATA_COLUMNS = ('id_data', 'path_data', 'id_product')
+PQ_SUBSPACES = 40
+PQ_CENTROIDS = 256
+PQ_RERANK = 64
+PQ_TRAIN_SIZE = 20000
+PQ_ENCODE_CHUNK = 65536
+# Com as colunas padronizadas, em dataset/ inteiro (benchmark.py --compare-cascade): M=25 e M=50 empatam na
+# acurácia e no tempo (a varredura do pré-filtro domina), mas M=50 recupera mais vizinhos exatos (0.95 x 0.91).
+CASCADE_SHORTLIST = 50
+SCALER_CHUNK = 65536
+
+
+def _squared_distances(queries, vectors, vector_norms=None):
+    if vector_norms is None:
+        vector_norms = np.einsum('ij,ij->i', vectors, vectors)
+    query_norms = np.einsum('ij,ij->i', queries, queries)
+    distances = query_norms[:, None] - 2 * queries @ vectors.T + vector_norms[None, :]
+    return np.maximum(distances, 0)
+
+
+def _top_k(query, vectors, distances, candidates, k):
+    if len(candidates) > k:
+        selected = np.argpartition(distances, k - 1)[:k]
+        candidates = candidates[selected]
+    # A expansão |q|² - 2q·v + |v|² perde precisão em float32; recalcula a distância dos k escolhidos.
+    distances = np.linalg.norm(vectors[candidates] - query, axis=1)
+    order = np.argsort(distances, kind='stable')
+    return distances[order], candidates[order]
+
+
+def fit_scaler(vectors):
+    """
+    Média e desvio padrão de cada coluna, para padronizar os vetores antes da
+    distância euclidiana: sem isso, colunas de escala grande (ex.: contrast do
+    GLCM, variância na casa de 10^4) decidem sozinhas a ordem dos vizinhos.
+    Calculados em blocos, sem uma cópia float64 da matriz.
+
+    Returns:
+        dict: mean e std (float32, um valor por coluna); colunas constantes ficam com std 1
+    """
+    total = np.zeros(vectors.shape[1], dtype=np.float64)
+    total_sq = np.zeros(vectors.shape[1], dtype=np.float64)
+    for i in range(0, len(vectors), SCALER_CHUNK):
+        chunk = np.asarray(vectors[i:i + SCALER_CHUNK], dtype=np.float64)
+        total += chunk.sum(axis=0)
+        total_sq += np.einsum('ij,ij->j', chunk, chunk)
+
+    mean = total / max(len(vectors), 1)
+    std = np.sqrt(np.maximum(total_sq / max(len(vectors), 1) - mean ** 2, 0))
+    std[std < 1e-6 * np.maximum(np.abs(mean), 1)] = 1.0
+    return {'mean': mean.astype(np.float32), 'std': std.astype(np.float32)}
+
+
+def standardize(vectors, scaler, copy=True):
+    """
+    Aplica o scaler de fit_scaler; com scaler None devolve os vetores como estão.
+    Com copy=False altera a matriz recebida (float32) em vez de alocar outra.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if scaler is None:
+        return vectors
+    if copy:
+        return (vectors - scaler['mean']) / scaler['std']
+    vectors -= scaler['mean']
+    vectors /= scaler['std']
+    return vectors
+
+
+def _append_metadata(metadata, rows):
+    """
+    Acrescenta linhas (dicts com METADATA_COLUMNS) aos arrays de metadados, sem
+    alterá-los. path_data vira object: mistura bytes (arquivo .pdi) e str (banco).
+    """
+    appended = {name: np.concatenate([metadata[name], np.asarray([row[name] for row in rows], dtype=np.int64)])
+                for name in METADATA_COLUMNS if name != 'path_data'}
+    appended['path_data'] = np.concatenate([np.asarray(metadata['path_data'], dtype=object),  #
+                                            np.asarray([row['path_data'] for row in rows], dtype=object)])
+    return appended
+
+
+def _kmeans(vectors, n_clusters, n_iter, rng):
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = np.argmin(_squared_distances(vectors, centroids), axis=1)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+
+    return centroids
+
+
+class ExactIndex:
+    """
+    Busca exata por força bruta (distância euclidiana). É o backend de referência:
+    build, add, query com k e filtro, to_arrays e from_arrays
+    (persistidos no arquivo .pdi, index_file.py).
+    """
+
+    kind = INDEX_EXACT
 
-class KNN:
     def __init__(self):
-        self.df_database_images = None
-        self.__load_df_database_images__()
-        self.knn = None
+        self.vectors = None
+        self.norms = None
 
-    def process_image_pdi_concat(self, image):
-        return knn_process_df_image(image_process=image)
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def __len__(self):
+        return 0 if self.vectors is None else len(self.vectors)
+
+    def build(self, vectors):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        return self
+
+    def add(self, vectors):
+        # Substitui os arrays em vez de alterá-los, para que cópias rasas do índice continuem válidas.
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.vectors = np.vstack([self.vectors, vectors])
+        self.norms = np.concatenate([self.norms, np.einsum('ij,ij->i', vectors, vectors)])
+        return self
+
+    def query(self, queries, k, allowed=None):
+        """
+        Args:
+            queries: Matriz (m, dim) de consultas
+            k: Número de vizinhos por consulta
+            allowed: Máscara booleana opcional das linhas que podem ser retornadas
+
+        Returns:
+            list: Um par (distâncias, índices) por consulta, ordenado pela distância
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        # Compara sempre com a matriz inteira: indexar pelas linhas permitidas copiaria quase todos os vetores
+        # (e, com np.memmap, traria a matriz para a memória do processo). O filtro só descarta as distâncias.
+        distances = _squared_distances(queries, self.vectors, self.norms)
+        n_allowed = len(self)
+        if allowed is not None:
+            distances[:, ~allowed] = np.inf
+            n_allowed = int(np.count_nonzero(allowed))
+
+        candidates = np.arange(len(self))
+        return [_top_k(query, self.vectors, row, candidates, min(k, n_allowed))
+                for query, row in zip(queries, distances)]
+
+    def distances(self, query, vectors):
+        """
+        Distância da consulta a vetores fora do índice (delta de confirmações), na
+        mesma métrica de query.
+        """
+        return np.linalg.norm(vectors - query, axis=1)
+
+    def to_arrays(self):
+        return {'vectors': self.vectors, 'norms': self.norms}
+
+    def params(self):
+        return {}
+
+    @classmethod
+    def from_arrays(cls, arrays, params=None):
+        """
+        Monta o índice sobre arrays já calculados (ex.: np.memmap), sem copiá-los.
+        """
+        index = cls(**(params or {}))
+        index.vectors, index.norms = arrays['vectors'], arrays['norms']
+        return index
+
+
+class IVFIndex(ExactIndex):
+    """
+    Índice aproximado com quantizador grosso (IVF): os vetores são agrupados por
+    k-means em n_lists listas invertidas e a consulta só compara os vetores das
+    n_probe listas cujos centróides estão mais próximos.
+    """
+
+    kind = INDEX_IVF
 
-    def __load_df_database_images__sql__(self, sql):
-        df_database_images = select_data(sql)
-        df_database_images['img'] = df_database_images.apply(lambda row: get_single_object_img(row['path_data']),axis=1)
+    def __init__(self, n_lists=None, n_probe=8, n_iter=10, seed=0):
+        super().__init__()
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids = None
+        self.lists = None
 
-        features = df_database_images['img'].apply(self.process_image_pdi_concat)
-        feature_matrix = np.vstack(features.values)
+    def __assign__(self, vectors):
+        return np.argmin(_squared_distances(vectors, self.centroids), axis=1)
 
-        num_cols = feature_matrix.shape[1]
-        feature_cols = [f'feat_{i}' for i in range(num_cols)]
+    def build(self, vectors):
+        super().build(vectors)
+        n_lists = min(len(self.vectors), self.n_lists or max(1, int(np.sqrt(len(self.vectors)))))
+        self.centroids = _kmeans(self.vectors, n_lists, self.n_iter, np.random.default_rng(self.seed))
 
-        df_features = pd.DataFrame(feature_matrix, columns=feature_cols)
-        df_database_images = pd.concat([df_database_images, df_features], axis=1)
+        assignment = self.__assign__(self.vectors)
+        self.lists = [np.flatnonzero(assignment == c) for c in range(n_lists)]
+        return self
 
-        knn = NearestNeighbors(n_neighbors=len(df_database_images), metric='euclidean')
-        knn.fit(feature_matrix)
+    def add(self, vectors):
+        start = len(self)
+        super().add(vectors)
 
-        return [df_database_images, knn]
+        assignment = self.__assign__(np.asarray(vectors, dtype=np.float32))
+        new_ids = np.arange(start, len(self))
+        self.lists = [np.concatenate([ids, new_ids[assignment == c]]) for c, ids in enumerate(self.lists)]
+        return self
 
-    def __load_df_database_images__(self, not_is_this_products=None):
-        if not_is_this_products is None:
-            not_is_this_products = []
+    def query(self, queries, k, allowed=None):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        list_order = np.argsort(_squared_distances(queries, self.centroids), axis=1)
+        results = []
+
+        for query, order in zip(queries, list_order):
+            # Sonda n_probe listas e continua enquanto o filtro deixar menos de k candidatos.
+            n_probe = min(self.n_probe, len(order))
+            while True:
+                candidates = np.concatenate([self.lists[c] for c in order[:n_probe]])
+                if allowed is not None:
+                    candidates = candidates[allowed[candidates]]
+                if len(candidates) >= k or n_probe == len(order):
+                    break
+                n_probe = min(len(order), n_probe * 2)
+
+            distances = _squared_distances(query[None], self.vectors[candidates], self.norms[candidates])[0]
+            results.append(_top_k(query, self.vectors, distances, candidates, min(k, len(candidates))))
+
+        return results
+
+    def to_arrays(self):
+        return {**super().to_arrays(),  #
+                'centroids': self.centroids,  #
+                'list_ids': np.concatenate(self.lists),  #
+                'list_sizes': np.array([len(ids) for ids in self.lists], dtype=np.int64)  #
+                }
+
+    def params(self):
+        return {'n_lists': len(self.centroids), 'n_probe': self.n_probe, 'n_iter': self.n_iter, 'seed': self.seed}
+
+    @classmethod
+    def from_arrays(cls, arrays, params=None):
+        index = super().from_arrays(arrays, params)
+        index.centroids = arrays['centroids']
+        index.lists = np.split(arrays['list_ids'], np.cumsum(arrays['list_sizes'])[:-1])
+        return index
+
+
+class PQIndex(ExactIndex):
+    """
+    Índice comprimido por quantização de produto (PQ): o vetor é dividido em
+    n_subspaces blocos e cada bloco vira o código uint8 do centróide mais
+    próximo no seu subespaço. A consulta estima as distâncias só pelos códigos,
+    com tabelas de distância assimétrica (ADC: a consulta não é quantizada), e
+    recalcula a distância exata dos rerank melhores candidatos (rerank=0 usa a
+    estimativa). Servido por np.memmap (index_store), a matriz completa só é
+    lida nessas linhas; o que precisa ficar residente são os códigos.
+    """
+
+    kind = INDEX_PQ
+
+    def __init__(self, n_subspaces=PQ_SUBSPACES, n_centroids=PQ_CENTROIDS, rerank=PQ_RERANK, n_iter=10, seed=0,
+                 train_size=PQ_TRAIN_SIZE):
+        super().__init__()
+        if not 1 <= n_centroids <= 256:
+            raise ValueError(f"n_centroids deve estar entre 1 e 256 (códigos uint8), recebido {n_centroids}")
+        self.n_subspaces = n_subspaces
+        self.n_centroids = n_centroids
+        self.rerank = rerank
+        self.n_iter = n_iter
+        self.seed = seed
+        self.train_size = train_size
+        # codebooks: (n_centroids, dim), as colunas de cada subespaço guardam os seus centróides.
+        self.codebooks = None
+        # codes: (n_subspaces, n), um subespaço por linha para a soma da ADC ler memória contígua.
+        self.codes = None
+
+    def __bounds__(self):
+        blocks = np.array_split(np.arange(self.dim), min(self.n_subspaces, self.dim))
+        return np.array([block[0] for block in blocks]), np.array([block[-1] + 1 for block in blocks])
+
+    def __encode__(self, vectors):
+        starts, ends = self.__bounds__()
+        codes = np.empty((len(starts), len(vectors)), dtype=np.uint8)
+        for j, (start, end) in enumerate(zip(starts, ends)):
+            for i in range(0, len(vectors), PQ_ENCODE_CHUNK):
+                distances = _squared_distances(vectors[i:i + PQ_ENCODE_CHUNK, start:end], self.codebooks[:, start:end])
+                codes[j, i:i + PQ_ENCODE_CHUNK] = np.argmin(distances, axis=1)
+        return codes
+
+    def build(self, vectors):
+        super().build(vectors)
+        rng = np.random.default_rng(self.seed)
+        sample = self.vectors if len(self) <= self.train_size \
+            else self.vectors[np.sort(rng.choice(len(self), self.train_size, replace=False))]
+        n_centroids = min(self.n_centroids, len(sample))
+
+        starts, ends = self.__bounds__()
+        self.codebooks = np.hstack([_kmeans(np.ascontiguousarray(sample[:, start:end]), n_centroids, self.n_iter, rng)
+                                    for start, end in zip(starts, ends)])
+        self.codes = self.__encode__(self.vectors)
+        return self
+
+    def add(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        super().add(vectors)
+        self.codes = np.concatenate([self.codes, self.__encode__(vectors)], axis=1)
+        return self
+
+    def query(self, queries, k, allowed=None):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        starts, _ = self.__bounds__()
+        n_allowed = len(self) if allowed is None else int(np.count_nonzero(allowed))
+        k = min(k, n_allowed)
+        shortlist_size = min(max(k, self.rerank), n_allowed)
+        results = []
 
-        if not_is_this_products != [] and isinstance(not_is_this_products, list):
-            not_is_this_products = [n for n in not_is_this_products if isinstance(n, int)]
+        for query in queries:
+            # Tabela (n_subspaces, n_centroids): distância da consulta a cada centróide de cada subespaço.
+            table = np.add.reduceat((self.codebooks - query) ** 2, starts, axis=1).T.copy()
+            approx = np.zeros(len(self), dtype=np.float32)
+            for j in range(len(starts)):
+                approx += table[j][self.codes[j]]
+            if allowed is not None:
+                approx[~allowed] = np.inf
 
-            return self.__load_df_database_images__sql__(f"""
-            SELECT d.* FROM data d
-            JOIN product_data pd ON pd.id_data = d.id_data
-            JOIN product p ON p.id_product = pd.id_product
-            WHERE p.id_product NOT IN ({','.join((map(str, not_is_this_products)))})
-            """)
+            shortlist = np.argpartition(approx, shortlist_size - 1)[:shortlist_size] if shortlist_size < len(self) \
+                else np.arange(len(self))
+            if self.rerank:
+                distances = _squared_distances(query[None], self.vectors[shortlist], self.norms[shortlist])[0]
+                results.append(_top_k(query, self.vectors, distances, shortlist, k))
+            else:
+                shortlist = shortlist[np.argsort(approx[shortlist], kind='stable')[:k]]
+                results.append((np.sqrt(approx[shortlist]), shortlist))
 
-        if self.df_database_images is None or self.knn is None:
-            self.df_database_images, self.knn = self.__load_df_database_images__sql__("""
-            SELECT d.* FROM data d
-            JOIN product_data pd ON pd.id_data = d.id_data
-            JOIN product p ON p.id_product = pd.id_product
-            """)
+        return results
 
-        return [self.df_database_images, self.knn]
+    def to_arrays(self):
+        return {**super().to_arrays(), 'codebooks': self.codebooks, 'codes': self.codes}
 
-    def knn_process_image(self, query_img, not_is_this_products):
-        df_database_images, knn = self.__load_df_database_images__(not_is_this_products)
+    def params(self):
+        return {'n_subspaces': self.n_subspaces, 'n_centroids': self.n_centroids, 'rerank': self.rerank,  #
+                'n_iter': self.n_iter, 'seed': self.seed, 'train_size': self.train_size}
 
-        query_vec = self.process_image_pdi_concat(query_img).reshape(1, -1)
-        distances, indices = knn.kneighbors(query_vec)
+    @classmethod
+    def from_arrays(cls, arrays, params=None):
+        index = super().from_arrays(arrays, params)
+        index.codebooks, index.codes = arrays['codebooks'], arrays['codes']
+        return index
+
+
+class CascadeIndex(ExactIndex):
+    """
+    Busca em dois estágios sobre vetores [histograma de cor | descritor]
+    (CONFIG_CASCATA): as prefilter_dim primeiras colunas, baratas de comparar,
+    selecionam os shortlist candidatos no catálogo inteiro, e só eles são
+    ordenados pela distância exata do descritor. As distâncias retornadas são
+    as do descritor; o histograma só decide quem é comparado.
+    """
+
+    kind = INDEX_CASCADE
+
+    def __init__(self, prefilter_dim=0, shortlist=CASCADE_SHORTLIST):
+        super().__init__()
+        if prefilter_dim <= 0:
+            raise ValueError("O índice em cascata precisa do histograma de cor no início do vetor "
+                             "(config com CONFIG_CASCATA)")
+        self.prefilter_dim = prefilter_dim
+        self.shortlist = shortlist
+        # Cópia contígua das colunas do pré-filtro: o produto com a matriz inteira não percorre o descritor.
+        self.prefilter = None
+        self.prefilter_norms = None
+
+    def build(self, vectors):
+        super().build(vectors)
+        self.prefilter = np.ascontiguousarray(self.vectors[:, :self.prefilter_dim])
+        self.prefilter_norms = np.einsum('ij,ij->i', self.prefilter, self.prefilter)
+        return self
+
+    def add(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        super().add(vectors)
+        prefilter = np.ascontiguousarray(vectors[:, :self.prefilter_dim])
+        self.prefilter = np.vstack([self.prefilter, prefilter])
+        self.prefilter_norms = np.concatenate([self.prefilter_norms, np.einsum('ij,ij->i', prefilter, prefilter)])
+        return self
+
+    def query(self, queries, k, allowed=None):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        # Como em ExactIndex.query, o filtro descarta distâncias em vez de copiar as linhas permitidas.
+        distances = _squared_distances(queries[:, :self.prefilter_dim], self.prefilter, self.prefilter_norms)
+        n_allowed = len(self)
+        if allowed is not None:
+            distances[:, ~allowed] = np.inf
+            n_allowed = int(np.count_nonzero(allowed))
+
+        shortlist_size = min(max(k, self.shortlist), n_allowed)
+        k = min(k, shortlist_size)
+        if shortlist_size < len(self):
+            shortlists = np.argpartition(distances, shortlist_size - 1, axis=1)[:, :shortlist_size]
+        else:
+            shortlists = np.broadcast_to(np.arange(len(self)), (len(queries), len(self)))
+
+        # Re-rank de todas as consultas de uma vez, pela expansão |q|² - 2q·v + |v|² só nas colunas do
+        # descritor (|v|² do descritor = norma completa - norma do pré-filtro, já calculadas).
+        query_descriptors = queries[:, self.prefilter_dim:]
+        products = np.einsum('qmd,qd->qm', self.vectors[shortlists, self.prefilter_dim:], query_descriptors)
+        shortlist_distances = (self.norms[shortlists] - self.prefilter_norms[shortlists]) - 2 * products \
+            + np.einsum('qd,qd->q', query_descriptors, query_descriptors)[:, None]
+        selected = np.take_along_axis(shortlists, np.argpartition(shortlist_distances, k - 1, axis=1)[:, :k], axis=1) \
+            if 0 < k < shortlists.shape[1] else shortlists
 
         results = []
-        for rank, idx in enumerate(indices[0]):
-            image_name = df_database_images.iloc[idx]['path_data']
-            distance = round(float(distances[0][rank]), 5)
+        for query, rows in zip(query_descriptors, selected):
+            # Como em _top_k, a distância dos k escolhidos é recalculada direto (a expansão perde precisão).
+            distances = np.linalg.norm(self.vectors[rows, self.prefilter_dim:] - query, axis=1)
+            order = np.argsort(distances, kind='stable')
+            results.append((distances[order], rows[order]))
+        return results
+
+    def distances(self, query, vectors):
+        return np.linalg.norm(vectors[:, self.prefilter_dim:] - query[self.prefilter_dim:], axis=1)
+
+    def to_arrays(self):
+        return {**super().to_arrays(), 'prefilter': self.prefilter, 'prefilter_norms': self.prefilter_norms}
+
+    def params(self):
+        return {'prefilter_dim': self.prefilter_dim, 'shortlist': self.shortlist}
+
+    @classmethod
+    def from_arrays(cls, arrays, params=None):
+        index = super().from_arrays(arrays, params)
+        index.prefilter, index.prefilter_norms = arrays['prefilter'], arrays['prefilter_norms']
+        return index
+
+
+INDEX_BACKENDS = {INDEX_EXACT: ExactIndex, INDEX_IVF: IVFIndex, INDEX_PQ: PQIndex, INDEX_CASCADE: CascadeIndex}
+
+
+class KNN:
+    def __init__(self, config=KNN_CONFIG, workers=EXTRACT_WORKERS, n_neighbors=KNN_NEIGHBORS, vote=VOTE_DISTANCE,
+                 index_backend=INDEX_EXACT, index_params=None, result_cache=None, index_store=None, autoload=True,
+                 standardize=True):
+        self.config = config
+        self.workers = workers
+        self.n_neighbors = n_neighbors
+        self.vote = vote
+        self.index_backend = index_backend
+        self.index_params = index_params or {}
+        if index_backend == INDEX_CASCADE:
+            # O tamanho do pré-filtro vem da configuração do pipeline, que monta o vetor.
+            self.index_params = {'prefilter_dim': dimensao_histograma_cor(config), **self.index_params}
+        self.config_hash = hash_pipeline_config(config)
+        # Metadados por linha do índice: um array por coluna de METADATA_COLUMNS (np.memmap quando vêm do .pdi).
+        self.metadata = None
+        self.index = None
+        self.product_ids = None
+        self.catalog = {}
+        # Padroniza as colunas (fit_scaler) ao montar o índice; consultas e delta passam pelo mesmo scaler.
+        self.standardize = standardize
+        self.scaler = None
+        self.lock = threading.Lock()
+        self.pending_vectors = OrderedDict()
+        self.delta_rows = []
+        self.delta_vectors = []
+        self.refit_thread = None
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        # Com index_store, o índice vem da versão publicada (np.memmap compartilhado entre workers).
+        self.index_store = index_store
+        self.index_version = None
+        self.version_checked_at = 0.0
+        if autoload:
+            self.__load_df_database_images__()
+
+    def process_image_pdi_concat(self, image):
+        return concatenar_caracteristicas(knn_process_df_image(image_process=image, config=self.config))
+
+    def __load_features__(self, df_database_images):
+        """
+        Returns:
+            tuple: (id_data -> vetor, scaler gravado no snapshot ou None, se algum vetor
+            precisou ser extraído)
+        """
+        df_snapshot = load_feature_snapshot(self.config_hash)
+
+        features_by_id = {}
+        watermark = 0
+        if df_snapshot is not None:
+            features_by_id = dict(zip(df_snapshot['id_data'].tolist(), df_snapshot['features']))
+            watermark = df_snapshot.attrs['watermark']
+
+        df_pending = df_database_images[(df_database_images['id_data'] > watermark) |  #
+                                        ~df_database_images['id_data'].isin(list(features_by_id))]
+        df_pending = df_pending.drop_duplicates(subset='id_data')
+
+        if len(df_pending) > 0:
+            features, _ = load_features(df_pending['path_data'].tolist(), self.config, extract_workers=self.workers)
+            features_by_id.update((i, f) for i, f in zip(df_pending['id_data'].tolist(), features) if f is not None)
+
+        return features_by_id, snapshot_scaler(df_snapshot), len(df_pending) > 0
+
+    def __load_df_database_images__sql__(self, sql, persist_snapshot=False):
+        df_database_images = select_data(sql).reset_index(drop=True)
+
+        features_by_id, scaler, extracted = self.__load_features__(df_database_images)
+        df_database_images = df_database_images[df_database_images['id_data'].isin(list(features_by_id))]
+        df_database_images = df_database_images.reset_index(drop=True)
+
+        features = [features_by_id[id_data] for id_data in df_database_images['id_data'].tolist()]
+        max_len = max(len(f) for f in features)
+        feature_matrix = np.vstack([ajustar_tamanho_vetor(f, max_len) for f in features]).astype(np.float32, copy=False)
+
+        # O scaler do snapshot reproduz o índice da carga anterior (inclusive o delta compactado nele); com
+        # vetores novos, é ajustado de novo.
+        if not self.standardize:
+            scaler = None
+        elif extracted or scaler is None or len(scaler['mean']) != max_len:
+            scaler = fit_scaler(feature_matrix)
+        if extracted and persist_snapshot:
+            save_feature_snapshot(self.config_hash, list(features_by_id.keys()), list(features_by_id.values()), scaler)
+        del features, features_by_id
+
+        return self.__build_index__(df_database_images, feature_matrix, scaler, copy=False)
+
+    def __build_index__(self, df_database_images, feature_matrix, scaler=None, copy=True):
+        # Os vetores ficam só no índice (float32 contíguo); dos metadados ficam só os arrays por linha.
+        catalog = self.__build_catalog__(df_database_images)
+        metadata = {name: df_database_images[name].to_numpy() for name in METADATA_COLUMNS}
+        if self.standardize and scaler is None:
+            scaler = fit_scaler(feature_matrix)
+        feature_matrix = standardize(feature_matrix, scaler, copy)
+        index = INDEX_BACKENDS[self.index_backend](**self.index_params).build(feature_matrix)
+
+        return [metadata, index, catalog, scaler]
+
+    def load_from_matrix(self, df_database_images, feature_matrix):
+        """
+        Monta o índice a partir de dados já em memória, sem Postgres nem MinIO.
+
+        Args:
+            df_database_images: DataFrame com id_data, path_data e id_product (nm_product e
+                vl_product opcionais, para o catálogo), uma linha por vetor
+            feature_matrix: Matriz (n, dim) de características, na mesma ordem
+        """
+        metadata, index, catalog, scaler = self.__build_index__(df_database_images, feature_matrix)
+        with self.lock:
+            self.metadata, self.index, self.scaler = metadata, index, scaler
+            self.product_ids = metadata['id_product']
+            self.catalog = catalog
+        self.result_cache.invalidate()
+
+    @staticmethod
+    def __build_catalog__(rows):
+        if isinstance(rows, pd.DataFrame):
+            if 'nm_product' not in rows:
+                return {}
+            rows = rows[['id_product', 'nm_product', 'vl_product']].drop_duplicates('id_product').to_dict('records')
+
+        return {int(row['id_product']): {'nm_product': row['nm_product'],  #
+                                         'vl_product': float(row['vl_product'])  #
+                                         } for row in rows}
+
+    def refresh_catalog(self):
+        """
+        Recarrega nome e preço de todos os produtos sem tocar nos vetores.
+
+        Returns:
+            int: Quantidade de produtos no catálogo
+        """
+        catalog = self.__build_catalog__(fetch_all('SELECT p.id_product, p.nm_product, p.vl_product FROM product p'))
+        self.catalog = catalog
+        return len(catalog)
+
+    def get_products(self, id_products):
+        """
+        Resolve nome e preço pelo catálogo em memória; só produtos ainda
+        desconhecidos (ex.: cadastrados depois da carga) vão ao banco.
+
+        Returns:
+            dict: id_product -> {nm_product, vl_product}
+        """
+        catalog = self.catalog
+        missing = [id_product for id_product in id_products if id_product not in catalog]
+        if missing:
+            catalog = {**catalog, **self.__build_catalog__(fetch_all("""
+            SELECT p.id_product, p.nm_product, p.vl_product FROM product p
+            WHERE p.id_product = ANY(:id_products)
+            """, {'id_products': missing}))}
+            self.catalog = catalog
+
+        return {id_product: catalog[id_product] for id_product in id_products if id_product in catalog}
+
+    def memory_usage(self):
+        """
+        Memória do índice e dos metadados, para dimensionar os pods. Arrays em
+        np.memmap (index_store, arquivo .pdi) contam como mapeados: ficam no page
+        cache do sistema, compartilhados entre os workers.
+
+        Returns:
+            dict: Bytes residentes e mapeados por componente e por item do catálogo
+        """
+        metadata, index, _, _, _, _ = self.__load_df_database_images__()
+        resident, mapped = {}, {}
+        for name, array in {**index.to_arrays(), **metadata}.items():
+            size = int(array.nbytes)
+            if array.dtype == object:
+                size += sum(sys.getsizeof(value) for value in array)
+            (mapped if isinstance(array, np.memmap) else resident)[name] = size
+
+        rows = max(len(index), 1)
+        return {'rows': len(index),  #
+                'index': index.kind,  #
+                'resident_bytes': resident,  #
+                'mapped_bytes': mapped,  #
+                'resident_bytes_per_item': round(sum(resident.values()) / rows, 1),  #
+                'mapped_bytes_per_item': round(sum(mapped.values()) / rows, 1)  #
+                }
+
+    def save_index_file(self, path, checksum=True):
+        """
+        Grava o índice carregado (sem o delta de confirmações) num arquivo .pdi.
+
+        Returns:
+            dict: Cabeçalho gravado
+        """
+        metadata, index, product_ids, _, _, scaler = self.__load_df_database_images__()
+        return write_index(path, index, metadata['id_data'], product_ids, metadata['path_data'], self.config_hash,
+                           self.catalog, checksum, scaler)
+
+    def load_index_file(self, path, verify=False):
+        """
+        Anexa um arquivo .pdi: vetores e metadados ficam em np.memmap, sem cópia nem
+        decodificação; os caminhos só são decodificados para os vizinhos retornados.
+
+        Args:
+            verify: Confere o sha256 antes (lê o arquivo inteiro)
+
+        Returns:
+            dict: Cabeçalho do arquivo
+        """
+        header, arrays, catalog = read_index(path, verify)
+        if header['config_hash'] != self.config_hash:
+            raise ValueError(f"O índice {path} foi gerado com outra configuração do pipeline "
+                             f"({header['config_hash']} != {self.config_hash})")
+
+        index = INDEX_BACKENDS[header['kind']].from_arrays(arrays, header['params'])
+        # Arquivos sem scaler guardam os vetores como extraídos; as consultas seguem sem padronizar.
+        scaler = {'mean': arrays['scaler_mean'], 'std': arrays['scaler_std']} if 'scaler_mean' in arrays else None
+        metadata = {name: arrays[name] for name in METADATA_COLUMNS}
+
+        with self.lock:
+            self.metadata, self.index, self.scaler = metadata, index, scaler
+            self.product_ids = metadata['id_product']
+            self.catalog = catalog
+            # Confirmações que o arquivo já contém saem do delta.
+            keep = ~np.isin(np.array([row['id_data'] for row in self.delta_rows], dtype=np.int64), metadata['id_data'])
+            self.delta_rows[:] = [row for row, k in zip(self.delta_rows, keep) if k]
+            self.delta_vectors[:] = [vector for vector, k in zip(self.delta_vectors, keep) if k]
+        self.result_cache.invalidate()
+        return header
+
+    def __attach_version__(self, version):
+        header = self.load_index_file(version_path(version, self.index_store))
+        self.index_version = version
+        print(f"[KNN] Versão {version} do índice anexada: {header['rows']} vetores")
+
+    def __check_index_version__(self):
+        now = time.monotonic()
+        if self.index is not None and now - self.version_checked_at < INDEX_POLL_SECONDS:
+            return
+        self.version_checked_at = now
+
+        version = current_version(self.index_store)
+        if version is not None and version != self.index_version:
+            self.__attach_version__(version)
+
+    def __load_df_database_images__(self):
+        if self.index_store is not None:
+            self.__check_index_version__()
+
+        with self.lock:
+            if self.metadata is None or self.index is None:
+                loaded = self.__load_df_database_images__sql__("""
+                SELECT d.id_data, d.path_data, p.id_product, p.nm_product, p.vl_product FROM data d
+                JOIN product_data pd ON pd.id_data = d.id_data
+                JOIN product p ON p.id_product = pd.id_product
+                """, persist_snapshot=True)
+                self.metadata, self.index, self.catalog, self.scaler = loaded
+                self.product_ids = self.metadata['id_product']
+                self.result_cache.invalidate()
+
+            return [self.metadata, self.index, self.product_ids, list(self.delta_rows),
+                    list(self.delta_vectors), self.scaler]
+
+    def __remember_vector__(self, id_data, path_data, query_vec):
+        with self.lock:
+            self.pending_vectors[id_data] = (path_data, query_vec)
+            while len(self.pending_vectors) > MAX_PENDING_VECTORS:
+                self.pending_vectors.popitem(last=False)
+
+    def add_confirmed_image(self, id_data, id_product):
+        """
+        Acrescenta ao índice em memória a imagem confirmada, reaproveitando o vetor
+        calculado na consulta. Quando o delta chega a DELTA_REFIT_THRESHOLD linhas,
+        o índice principal é reconstruído em segundo plano.
+
+        Args:
+            id_data: Identificador do dado enviado em /process-image
+            id_product: Produto confirmado pelo cliente
+
+        Returns:
+            bool: False se o vetor da consulta não estiver mais disponível (a imagem
+            entra no índice na próxima carga completa)
+        """
+        with self.lock:
+            pending = self.pending_vectors.pop(id_data, None)
+            if pending is None:
+                return False
+
+            path_data, query_vec = pending
+            self.delta_rows.append({'id_data': id_data, 'path_data': path_data, 'id_product': id_product})
+            self.delta_vectors.append(query_vec)
+
+            self.result_cache.invalidate()
+
+            # Com index_store, compactar copiaria a matriz compartilhada para cada worker; o delta
+            # é absorvido pela próxima versão publicada.
+            if len(self.delta_rows) >= DELTA_REFIT_THRESHOLD and self.refit_thread is None \
+                    and self.index_store is None:
+                self.refit_thread = threading.Thread(target=self.__compact_delta__, daemon=True)
+                self.refit_thread.start()
+
+        return True
+
+    def __compact_delta__(self):
+        try:
+            with self.lock:
+                metadata = self.metadata
+                delta_rows, delta_vectors = list(self.delta_rows), list(self.delta_vectors)
+                base_index, scaler = self.index, self.scaler
+                index = copy.copy(base_index)
+
+            # O delta guarda os vetores como extraídos; entra no índice padronizado pelo mesmo scaler.
+            index.add(standardize(np.vstack(delta_vectors), scaler))
+            metadata = _append_metadata(metadata, delta_rows)
+
+            with self.lock:
+                if self.index is not base_index:
+                    return
+                self.metadata, self.index = metadata, index
+                self.product_ids = metadata['id_product']
+                del self.delta_rows[:len(delta_rows)]
+                del self.delta_vectors[:len(delta_vectors)]
+                self.result_cache.invalidate()
+
+            # O snapshot guarda os vetores sem padronizar, como extraídos, e o scaler com que o índice foi montado.
+            vectors = index.vectors if scaler is None else index.vectors * scaler['std'] + scaler['mean']
+            save_feature_snapshot(self.config_hash, metadata['id_data'].tolist(), list(vectors), scaler)
+        finally:
+            with self.lock:
+                self.refit_thread = None
+
+    def __vote__(self, neighbors, top_products=TOP_PRODUCTS):
+        scores = {}
+        best = {}
+        for neighbor in neighbors:
+            weight = 1.0 if self.vote == VOTE_MAJORITY else 1.0 / (neighbor['distance'] + 1e-6)
+            scores[neighbor['id_product']] = scores.get(neighbor['id_product'], 0.0) + weight
+            best.setdefault(neighbor['id_product'], neighbor)
+
+        total = sum(scores.values())
+        ranking = sorted(scores, key=lambda p: (-scores[p], best[p]['distance']))
+
+        return [{'id_product': int(id_product),  #
+                 'score': round(scores[id_product] / total, 5),  #
+                 'image_path': best[id_product]['image_path'],  #
+                 'distance': best[id_product]['distance']  #
+                 } for id_product in ranking[:top_products]]
+
+    def __search__(self, state, query_vecs, not_is_this_products, top_products):
+        metadata, index, product_ids, delta_rows, delta_vectors, scaler = state
+        path_data = metadata['path_data']
+        query_vecs = standardize(query_vecs, scaler)
+
+        # Os produtos descartados viram um filtro sobre o índice já carregado, sem reconstruí-lo.
+        allowed = ~np.isin(product_ids, not_is_this_products)
+        if allowed.any():
+            results = index.query(query_vecs, self.n_neighbors, allowed)
+        else:
+            results = [(np.array([]), np.array([], dtype=np.int64))] * len(query_vecs)
+
+        # Imagens confirmadas depois da última carga ficam num delta pequeno, comparado por força bruta.
+        delta_allowed = [row['id_product'] not in not_is_this_products for row in delta_rows]
+        delta_rows = [row for row, keep in zip(delta_rows, delta_allowed) if keep]
+        delta_vectors = [vector for vector, keep in zip(delta_vectors, delta_allowed) if keep]
+        if delta_vectors:
+            delta_matrix = standardize(np.vstack(delta_vectors), scaler)
+            delta_distances = [index.distances(q, delta_matrix) for q in query_vecs]
+        else:
+            delta_distances = [[]] * len(query_vecs)
+
+        candidates = []
+        for (distances, indices), query_delta_distances in zip(results, delta_distances):
+            neighbors = [{'id_product': product_ids[idx],  #
+                          'image_path': decode_path(path_data[idx]),  #
+                          'distance': round(float(distance), 5)  #
+                          } for distance, idx in zip(distances, indices)]
+            neighbors += [{'id_product': row['id_product'],  #
+                           'image_path': row['path_data'],  #
+                           'distance': round(float(distance), 5)  #
+                           } for row, distance in zip(delta_rows, query_delta_distances)]
+
+            neighbors = sorted(neighbors, key=lambda n: n['distance'])[:self.n_neighbors]
+            candidates.append(self.__vote__(neighbors, top_products))
+
+        return candidates
+
+    @timed('knn_process_image')
+    def knn_process_image(self, query_img, not_is_this_products, id_data=None, path_data=None,
+                          top_products=TOP_PRODUCTS, cache_key=None):
+        """
+        Busca os k vizinhos mais próximos e agrega por produto (voto majoritário ou
+        ponderado pela distância).
+
+        Args:
+            cache_key: content_key dos bytes enviados; com ele, reenvios da mesma
+                imagem reaproveitam o vetor e, sem not-is, os candidatos
+
+        Returns:
+            list: Até top_products candidatos ordenados pelo score, cada um com
+            id_product, score, image_path e distance do vizinho mais próximo
+        """
+        not_is_this_products = not_is_this_products or []
+        state = self.__load_df_database_images__()
+
+        cached = None
+        if cache_key is not None:
+            cached = self.result_cache.get(cache_key, query_img, with_candidates=not not_is_this_products)
+        # O vetor de uma quase-duplicata é de outra foto: serve só para reaproveitar os candidatos.
+        # Sem candidatos prontos, a busca usa o vetor desta imagem.
+        if cached is not None and cached['near'] and (cached['candidates'] is None or not_is_this_products):
+            cached = None
+
+        if cached is not None:
+            query_vec = ajustar_tamanho_vetor(cached['vector'], state[1].dim)
+        else:
+            query_vec = ajustar_tamanho_vetor(self.process_image_pdi_concat(query_img), state[1].dim)
+        # Só vetores extraídos desta imagem vão para o delta na confirmação; depois de uma quase-duplicata,
+        # add_confirmed_image retorna False e a imagem entra no índice na próxima carga.
+        if path_data is not None and not (cached is not None and cached['near']):
+            self.__remember_vector__(id_data, path_data, query_vec)
+
+        if cached is not None and cached['candidates'] is not None and not not_is_this_products:
+            return cached['candidates'][:top_products]
+
+        with timed('knn_search'):
+            candidates = self.__search__(state, query_vec[None], not_is_this_products, top_products)[0]
+
+        if cache_key is not None:
+            self.result_cache.put(cache_key, query_vec, None if not_is_this_products else candidates,
+                                  id_data=id_data if path_data is not None else None, path_data=path_data,
+                                  image=query_img)
+        return candidates
+
+    def knn_process_images(self, query_imgs, ids_data=None, paths_data=None, top_products=TOP_PRODUCTS,
+                           workers=BATCH_WORKERS):
+        """
+        Versão em lote de knn_process_image: extrai as características em paralelo e
+        consulta o índice uma única vez com a matriz empilhada.
+
+        Returns:
+            list: Para cada imagem, na ordem de entrada, a lista de candidatos ou a
+            exceção levantada ao extraí-la
+        """
+        state = self.__load_df_database_images__()
+
+        def extract(query_img):
+            try:
+                return ajustar_tamanho_vetor(self.process_image_pdi_concat(query_img), state[1].dim)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(query_imgs)))) as executor:
+            query_vecs = list(executor.map(extract, query_imgs))
 
-            results.append({'image_path': image_name, 'distance': distance})
+        valid = [i for i, v in enumerate(query_vecs) if not isinstance(v, Exception)]
+        for i in valid:
+            if paths_data is not None and paths_data[i] is not None:
+                self.__remember_vector__(ids_data[i], paths_data[i], query_vecs[i])
 
-        df_results = (pd.DataFrame(results).sort_values(by='distance', ascending=True).reset_index(drop=True))
+        results = list(query_vecs)
+        if valid:
+            candidates = self.__search__(state, np.vstack([query_vecs[i] for i in valid]), [], top_products)
+            for i, c in zip(valid, candidates):
+                results[i] = c
 
-        return df_results.iloc[0]['image_path']
+        return results
@@ -18,28 +18,54 @@ def extrair_caracteristicas_forma(contornos):
         })
     return caracteristicas
 
-def extrair_lbp(imagem, P=8, R=1):
+def extrair_lbp(imagem, P=8, R=1, bins=None, visualizar=True):
     lbp = local_binary_pattern(imagem, P=P, R=R, method="uniform")
-    lbp_norm = (lbp - lbp.min()) / (lbp.max() - lbp.min() + 1e-9)
-    lbp_img = (lbp_norm * 255).astype("uint8")
     
-    lbp_bins = np.arange(0, lbp.max() + 2)
-    lbp_hist, _ = np.histogram(lbp.ravel(), bins=lbp_bins, density=True)
+    lbp_img = None
+    if visualizar:
+        lbp_norm = (lbp - lbp.min()) / (lbp.max() - lbp.min() + 1e-9)
+        lbp_img = (lbp_norm * 255).astype("uint8")
+    
+    if bins is None:
+        lbp_bins = np.arange(0, lbp.max() + 2)
+        lbp_hist, _ = np.histogram(lbp.ravel(), bins=lbp_bins, density=True)
+    else:
+        lbp_hist, _ = np.histogram(lbp.ravel(), bins=bins, range=(0, bins), density=True)
     
     return lbp_img, lbp_hist
 
-def extrair_glcm(imagem, distancias=[1, 2, 3], angulos=[0, np.pi/4, np.pi/2, 3*np.pi/4]):
-    glcm = graycomatrix(imagem, distances=distancias, angles=angulos, levels=256, symmetric=True, normed=True)
+GLCM_PROPRIEDADES = ["contrast", "dissimilarity", "homogeneity", "ASM", "energy", "correlation"]
+
+def quantizar_niveis(imagem, niveis):
+    if niveis >= 256:
+        return imagem
+    return (imagem.astype(np.uint16) * niveis // 256).astype(np.uint8)
+
+def extrair_glcm(imagem, distancias=[1, 2, 3], angulos=[0, np.pi/4, np.pi/2, 3*np.pi/4], niveis=256,
+                 propriedades=None):
+    glcm = graycomatrix(quantizar_niveis(imagem, niveis), distances=distancias, angles=angulos, levels=niveis,
+                        symmetric=True, normed=True)
     
     caracteristicas = {}
-    propriedades = ["contrast", "dissimilarity", "homogeneity", "ASM", "energy", "correlation"]
+    propriedades = propriedades or GLCM_PROPRIEDADES
     
     for prop in propriedades:
         caracteristicas[prop] = float(graycoprops(glcm, prop).mean())
     
     return caracteristicas
 
-def extrair_hog(imagem, orientacoes=9, pixels_por_celula=(16, 16), celulas_por_bloco=(2, 2)):
+def extrair_hog(imagem, orientacoes=9, pixels_por_celula=(16, 16), celulas_por_bloco=(2, 2), visualizar=True):
+    if not visualizar:
+        hog_vector = hog(
+            imagem,
+            orientations=orientacoes,
+            pixels_per_cell=pixels_por_celula,
+            cells_per_block=celulas_por_bloco,
+            block_norm="L2-Hys",
+            feature_vector=True,
+        )
+        return hog_vector, None
+    
     hog_vector, hog_vis = hog(
         imagem,
         orientations=orientacoes,
@@ -54,3 +80,15 @@ def extrair_hog(imagem, orientacoes=9, pixels_por_celula=(16, 16), celulas_por_b
     hog_img = (hog_vis_norm * 255).astype("uint8")
     
     return hog_vector, hog_img
+
+def extrair_histograma_cor(imagem, bins=256):
+    # Descritor de examples/test_images_knn.ipynb: histogramas de cinza, B, G e R, cada um normalizado (L2).
+    cinza = cv2.cvtColor(imagem, cv2.COLOR_BGR2GRAY)
+    canais = [(cinza, 0), (imagem, 0), (imagem, 1), (imagem, 2)]
+    
+    histogramas = []
+    for img, canal in canais:
+        hist = cv2.calcHist([img], [canal], None, [bins], [0, 256])
+        histogramas.append(cv2.normalize(hist, hist).flatten())
+    
+    return np.concatenate(histogramas)
@@ -1,3 +1,5 @@
+from concurrent.futures import ProcessPoolExecutor
+
 import cv2
 import numpy as np
 
@@ -22,6 +24,74 @@ def calcular_gradientes(imagem):
     return magnitude, angulo
 
 
+def _histogramas_celulas(magnitude, angulo, orientations, pixels_per_cell):
+    """
+    Acumula os histogramas de orientação de todas as células de uma pilha de imagens.
+    
+    Cada pixel contribui para os dois bins vizinhos com interpolação linear, como na
+    implementação pixel a pixel original, mas via np.bincount sobre a pilha inteira.
+    
+    Args:
+        magnitude: Magnitudes dos gradientes, formato (N, altura, largura)
+        angulo: Ângulos dos gradientes em graus [0, 180), mesmo formato
+        orientations: Número de orientações do gradiente
+        pixels_per_cell: Tamanho da célula em pixels
+        
+    Returns:
+        np.ndarray: Histogramas no formato (N, n_cells_h, n_cells_w, orientations)
+    """
+    n_imagens, altura, largura = magnitude.shape
+    cell_h, cell_w = pixels_per_cell
+    n_cells_h = altura // cell_h
+    n_cells_w = largura // cell_w
+    
+    # Pixels fora da última célula completa são ignorados, como no laço original
+    magnitude = magnitude[:, :n_cells_h * cell_h, :n_cells_w * cell_w]
+    angulo = angulo[:, :n_cells_h * cell_h, :n_cells_w * cell_w]
+    
+    bin_idx = angulo / (180 / orientations)
+    bin_floor = np.floor(bin_idx)
+    weight = bin_idx - bin_floor
+    bin_low = bin_floor.astype(np.int64) % orientations
+    bin_high = (bin_low + 1) % orientations
+    
+    linhas = np.arange(n_cells_h * cell_h) // cell_h
+    colunas = np.arange(n_cells_w * cell_w) // cell_w
+    celula = (linhas[:, None] * n_cells_w + colunas[None, :])[None, :, :]
+    base = (np.arange(n_imagens)[:, None, None] * (n_cells_h * n_cells_w) + celula) * orientations
+    
+    total = n_imagens * n_cells_h * n_cells_w * orientations
+    hist = np.bincount((base + bin_low).ravel(), weights=(magnitude * (1 - weight)).ravel(), minlength=total)
+    hist += np.bincount((base + bin_high).ravel(), weights=(magnitude * weight).ravel(), minlength=total)
+    
+    return hist.reshape(n_imagens, n_cells_h, n_cells_w, orientations)
+
+
+def _normalizar_blocos(cell_histograms, cells_per_block):
+    """
+    Normaliza (L2) os blocos sobrepostos de células e em seguida o vetor completo.
+    
+    Args:
+        cell_histograms: Histogramas no formato (N, n_cells_h, n_cells_w, orientations)
+        cells_per_block: Número de células por bloco
+        
+    Returns:
+        np.ndarray: Vetores HOG normalizados, formato (N, n_features), float32
+    """
+    n_imagens = cell_histograms.shape[0]
+    block_h, block_w = cells_per_block
+    
+    # (N, n_blocks_h, n_blocks_w, orientations, block_h, block_w) -> ordem (block_h, block_w, orientations)
+    blocos = np.lib.stride_tricks.sliding_window_view(cell_histograms, (block_h, block_w), axis=(1, 2))
+    blocos = blocos.transpose(0, 1, 2, 4, 5, 3).reshape(n_imagens, -1, block_h * block_w * cell_histograms.shape[3])
+    
+    norma = np.sqrt(np.sum(blocos ** 2, axis=2, keepdims=True) + 1e-6)
+    hog_features = (blocos / norma).reshape(n_imagens, -1).astype(np.float32)
+    
+    norma_global = np.linalg.norm(hog_features, axis=1, keepdims=True)
+    return hog_features / (norma_global + 1e-8)
+
+
 def calcular_hog_array(imagem, orientations=9, pixels_per_cell=(8, 8), cells_per_block=(2, 2)):
     """
     Calcula o Histogram of Oriented Gradients (HOG) de uma imagem.
@@ -35,50 +105,68 @@ def calcular_hog_array(imagem, orientations=9, pixels_per_cell=(8, 8), cells_per
     Returns:
         list: Vetor HOG normalizado
     """
-    altura, largura = imagem.shape
-    cell_h, cell_w = pixels_per_cell
-    block_h, block_w = cells_per_block
-
     magnitude, angulo = calcular_gradientes(imagem)
-    n_cells_h = altura // cell_h
-    n_cells_w = largura // cell_w
-    cell_histograms = np.zeros((n_cells_h, n_cells_w, orientations))
-    bin_size = 180 / orientations
-
-    for i in range(n_cells_h):
-        for j in range(n_cells_w):
-            y_start, y_end = i * cell_h, (i + 1) * cell_h
-            x_start, x_end = j * cell_w, (j + 1) * cell_w
-            cell_mag = magnitude[y_start:y_end, x_start:x_end]
-            cell_ang = angulo[y_start:y_end, x_start:x_end]
-            for y in range(cell_h):
-                for x in range(cell_w):
-                    mag_val = cell_mag[y, x]
-                    ang_val = cell_ang[y, x]
-                    bin_idx = ang_val / bin_size
-                    bin_low = int(bin_idx) % orientations
-                    bin_high = (bin_low + 1) % orientations
-                    weight = bin_idx - int(bin_idx)
-                    cell_histograms[i, j, bin_low] += mag_val * (1 - weight)
-                    cell_histograms[i, j, bin_high] += mag_val * weight
-
-    n_blocks_h = n_cells_h - block_h + 1
-    n_blocks_w = n_cells_w - block_w + 1
-    hog_features = []
-
-    for i in range(n_blocks_h):
-        for j in range(n_blocks_w):
-            block = cell_histograms[i:i+block_h, j:j+block_w, :]
-            block_vector = block.flatten()
-            norm = np.sqrt(np.sum(block_vector**2) + 1e-6)
-            block_vector = block_vector / norm
-            hog_features.extend(block_vector)
-
-    hog_features = np.array(hog_features, dtype=np.float32)
-    norm_global = np.linalg.norm(hog_features)
-    hog_features_normalized = hog_features / (norm_global + 1e-8)
-
-    return hog_features_normalized.tolist()
+    cell_histograms = _histogramas_celulas(magnitude[None], angulo[None], orientations, pixels_per_cell)
+
+    return _normalizar_blocos(cell_histograms, cells_per_block)[0].tolist()
+
+
+def dimensao_hog(altura, largura, orientations=9, pixels_per_cell=(8, 8), cells_per_block=(2, 2)):
+    """
+    Returns:
+        int: Tamanho do vetor HOG de uma imagem altura x largura
+    """
+    n_blocks_h = max(altura // pixels_per_cell[0] - cells_per_block[0] + 1, 0)
+    n_blocks_w = max(largura // pixels_per_cell[1] - cells_per_block[1] + 1, 0)
+    return n_blocks_h * n_blocks_w * cells_per_block[0] * cells_per_block[1] * orientations
+
+
+def _calcular_hog_pilha(imagens, orientations, pixels_per_cell, cells_per_block):
+    gradientes = [calcular_gradientes(imagem) for imagem in imagens]
+    magnitude = np.stack([g[0] for g in gradientes])
+    angulo = np.stack([g[1] for g in gradientes])
+    
+    cell_histograms = _histogramas_celulas(magnitude, angulo, orientations, pixels_per_cell)
+    return _normalizar_blocos(cell_histograms, cells_per_block)
+
+
+def calcular_hog_lote(imagens, orientations=9, pixels_per_cell=(8, 8), cells_per_block=(2, 2), workers=1,
+                      tamanho_lote=64):
+    """
+    Calcula o HOG de uma pilha de imagens em escala de cinza do mesmo tamanho.
+    
+    Args:
+        imagens: Array (N, altura, largura) ou lista de imagens com o mesmo formato
+        orientations: Número de orientações do gradiente (padrão: 9)
+        pixels_per_cell: Tamanho da célula em pixels (padrão: (8, 8))
+        cells_per_block: Número de células por bloco (padrão: (2, 2))
+        workers: Processos usados para dividir a pilha (padrão: 1, sem pool)
+        tamanho_lote: Imagens processadas juntas por tarefa (padrão: 64)
+        
+    Returns:
+        np.ndarray: Matriz (N, n_features) float32, uma linha por imagem
+        
+    Raises:
+        ValueError: Se as imagens não tiverem todas o mesmo formato
+    """
+    imagens = np.asarray(imagens)
+    if len(imagens) == 0:
+        # Pilha vazia: sem formato conhecido (ex.: lista vazia), o vetor tem dimensão 0.
+        dim = dimensao_hog(*imagens.shape[1:], orientations, pixels_per_cell, cells_per_block) \
+            if imagens.ndim == 3 else 0
+        return np.empty((0, dim), dtype=np.float32)
+    if imagens.ndim != 3:
+        raise ValueError(f"Esperada pilha (N, altura, largura) de imagens do mesmo tamanho, recebido {imagens.shape}")
+    
+    lotes = [imagens[i:i + tamanho_lote] for i in range(0, len(imagens), tamanho_lote)]
+    parametros = (orientations, pixels_per_cell, cells_per_block)
+    
+    if workers <= 1 or len(lotes) <= 1:
+        return np.vstack([_calcular_hog_pilha(lote, *parametros) for lote in lotes])
+    
+    with ProcessPoolExecutor(max_workers=min(workers, len(lotes))) as executor:
+        resultados = executor.map(_calcular_hog_pilha, lotes, *[[p] * len(lotes) for p in parametros])
+        return np.vstack(list(resultados))
 
 
 def extrair_hog(caminho_imagem, orientations=9, pixels_per_cell=(8, 8), cells_per_block=(2, 2)):
@@ -1,10 +1,105 @@
+import hashlib
+import json
+
 import cv2
 import numpy as np
 import pandas as pd
-from libs.preprocessing import converter_para_cinza, aplicar_filtro_gaussiano, detectar_bordas_canny
-from libs.segmentation import segmentar_objeto_com_flood_fill, filtrar_contornos_borda, encontrar_contornos, desenhar_contornos
+from libs.preprocessing import converter_para_cinza, aplicar_filtro_gaussiano, detectar_bordas_canny, \
+    decodificar_reduzida, redimensionar
+from libs.segmentation import segmentar_objeto_com_flood_fill, filtrar_contornos_borda, encontrar_contornos, desenhar_contornos, \
+    contorno_principal, caixa_com_margem, recortar_regiao
 from libs.geometric import calcular_area, calcular_perimetro, calcular_circularidade, calcular_aspect_ratio
-from libs.features import extrair_lbp, extrair_glcm, extrair_hog
+from libs.features import extrair_lbp, extrair_glcm, extrair_hog, extrair_histograma_cor, GLCM_PROPRIEDADES
+from libs.pipeline import registrar_etapa, executar_etapas
+from libs.timers import etapa
+
+PIPELINE_VERSION = 1
+
+MODO_COMPLETO = 'completo'
+MODO_DESCRITOR = 'descritor'
+
+PIPELINE_CONFIG = {
+    'modo': MODO_COMPLETO,
+    'tamanho_canonico': (100, 100),
+    'lado_maximo': 1024,
+    'gaussiano_kernel': (5, 5),
+    'canny_limiares': (100, 200),
+    'hog_orientacoes': 9,
+    'hog_pixels_por_celula': (16, 16),
+    'hog_celulas_por_bloco': (2, 2),
+    'lbp_p': 8,
+    'lbp_r': 1,
+    'lbp_bins_fixos': False,
+    'glcm_niveis': 256,
+    'glcm_distancias': [1, 2, 3],
+    'glcm_angulos': [0, np.pi / 4, np.pi / 2, 3 * np.pi / 4],
+    'glcm_propriedades': GLCM_PROPRIEDADES,
+}
+
+# Textura rápida: GLCM com 32 níveis, 1 distância, 2 ângulos e sem as propriedades
+# redundantes (energy = sqrt(ASM), dissimilarity acompanha contrast); LBP com bins
+# fixos também no modo completo. Mesclar sobre PIPELINE_CONFIG/KNN_CONFIG.
+# Comparação de tempo e acurácia: benchmark.py --compare-texture
+CONFIG_TEXTURA_RAPIDA = {
+    'lbp_bins_fixos': True,
+    'glcm_niveis': 32,
+    'glcm_distancias': [1],
+    'glcm_angulos': [0, np.pi / 2],
+    'glcm_propriedades': ['contrast', 'homogeneity', 'ASM', 'correlation'],
+}
+
+# Cascata: o histograma de cor (cinza + BGR) entra no início do vetor e serve de pré-filtro barato
+# (knn_process_image.CascadeIndex). Com 32 bins por canal são 128 colunas, contra 1024 no notebook
+# (256 bins), para que comparar a consulta com o catálogo inteiro custe bem menos que o descritor.
+# Fora do PIPELINE_CONFIG de propósito: sem a chave, o hash (e os snapshots) das outras configurações
+# não muda. Mesclar sobre PIPELINE_CONFIG/KNN_CONFIG.
+CONFIG_CASCATA = {
+    'histograma_cor_bins': 32,
+}
+
+# ROI: HOG, LBP e GLCM passam a ser calculados sobre o recorte do contorno principal (caixa
+# delimitadora + roi_margem de cada lado, fundo zerado com roi_mascara), redimensionado para
+# roi_tamanho (None = tamanho_canonico). O contorno é achado na imagem normalizada, mas o recorte sai
+# da imagem decodificada (antes de normalizar_entrada): no modo descritor a entrada já tem 100x100 e
+# recortar dela só ampliaria o objeto com interpolação. Por isso o ROI só acrescenta detalhe quando a
+# foto é maior que o tamanho canônico (não em dataset/, já 100x100). Sem contorno que sobreviva ao
+# filtro de borda, usa o quadro inteiro normalizado, então o vetor tem sempre o mesmo comprimento.
+# Como o histograma de cor, fica fora do PIPELINE_CONFIG para não mudar o hash das outras
+# configurações.
+CONFIG_ROI = {
+    'roi_recorte': True,
+    'roi_margem': 0.1,
+    'roi_mascara': False,
+    'roi_tamanho': None,
+}
+
+
+def hash_pipeline_config(config=None):
+    config = {**PIPELINE_CONFIG, **(config or {})}
+    conteudo = json.dumps({'versao': PIPELINE_VERSION, 'config': config}, sort_keys=True, default=str)
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()[:16]
+
+
+def concatenar_caracteristicas(caracteristicas) -> np.ndarray:
+    return np.concatenate([np.ravel(np.asarray(v, dtype=np.float32)) for v in caracteristicas.values()])
+
+
+def ajustar_tamanho_vetor(vetor, tamanho) -> np.ndarray:
+    if len(vetor) == tamanho:
+        return vetor
+    ajustado = np.zeros(tamanho, dtype=np.float32)
+    ajustado[:min(tamanho, len(vetor))] = vetor[:tamanho]
+    return ajustado
+
+
+def dimensao_histograma_cor(config=None):
+    """
+    Returns:
+        int: Colunas do histograma de cor no início do vetor (0 quando desligado)
+    """
+    bins = {**PIPELINE_CONFIG, **(config or {})}.get('histograma_cor_bins')
+    return 4 * bins if bins else 0
+
 
 def ensure_flatten(x) -> np.ndarray:
     if isinstance(x, dict):
@@ -24,56 +119,283 @@ def ensure_flatten(x) -> np.ndarray:
         return np.array([x], dtype=float)
     return np.array([0.0], dtype=float)
 
-def knn_process_df_image(image_path=None, image_process=None):
-    if image_path != None:
-        image_process = cv2.imread(image_path)
-    
-    img_rgb = cv2.cvtColor(image_process, cv2.COLOR_BGR2RGB)
-    img_cinza = converter_para_cinza(image_process)
-    img_suavizada = aplicar_filtro_gaussiano(img_cinza)
-    img_bordas_canny = detectar_bordas_canny(img_suavizada)
+def tamanho_entrada(largura, altura, config):
+    """
+    Tamanho com que a imagem entra no pipeline: o canônico no modo descritor; no
+    modo completo, a proporção original limitada a lado_maximo.
+    """
+    if config['modo'] == MODO_DESCRITOR:
+        return tuple(config['tamanho_canonico'])
+
+    lado_maximo = config['lado_maximo']
+    if not lado_maximo or max(largura, altura) <= lado_maximo:
+        return largura, altura
+    escala = lado_maximo / max(largura, altura)
+    return max(1, round(largura * escala)), max(1, round(altura * escala))
+
+
+def normalizar_entrada(image_process, config):
+    altura, largura = image_process.shape[:2]
+    return redimensionar(image_process, *tamanho_entrada(largura, altura, config))
+
+
+def decodificar_entrada(dados, config=None):
+    """
+    Decodifica os bytes de uma imagem (upload, objeto do MinIO, arquivo) já
+    reduzida pelo libjpeg quando o tamanho de entrada do pipeline permite, para
+    que fotos de vários megapixels não sejam decodificadas por inteiro.
+
+    Returns:
+        np.ndarray | None: Imagem BGR, ainda não normalizada, ou None se inválida
+    """
+    config = {**PIPELINE_CONFIG, **(config or {})}
+    return decodificar_reduzida(dados, lambda largura, altura: tamanho_entrada(largura, altura, config))
+
+
+def metricas_geometricas(contornos_filtrados, altura_img, largura_img, normalizar=False):
+    if not contornos_filtrados:
+        return [0.0, 0.0, 0.0, 0.0] if normalizar else []
     
-    mascara_segmentada = segmentar_objeto_com_flood_fill(img_suavizada)
-    contornos = encontrar_contornos(mascara_segmentada)
-    altura_img, largura_img = img_cinza.shape
-    contornos_filtrados = filtrar_contornos_borda(contornos, largura_img, altura_img)
-    mascara_final = np.zeros_like(img_cinza)
-    img_com_contornos = desenhar_contornos(img_rgb, contornos_filtrados, cor=(0, 255, 0), espessura=2)
+    contorno_principal = max(contornos_filtrados, key=cv2.contourArea)
+    area = calcular_area(contorno_principal)
+    perimetro = calcular_perimetro(contorno_principal)
+    circularidade = calcular_circularidade(contorno_principal)
+    aspect_ratio = calcular_aspect_ratio(contorno_principal)
     
-    if contornos_filtrados:
-        contorno_principal = max(contornos_filtrados, key=cv2.contourArea)
-    else:
-        contorno_principal = None
+    if normalizar:
+        area = area / (altura_img * largura_img)
+        perimetro = perimetro / (2 * (altura_img + largura_img))
     
-    metricas_geo = []
-    if contorno_principal is not None:
-        area = calcular_area(contorno_principal)
-        perimetro = calcular_perimetro(contorno_principal)
-        circularidade = calcular_circularidade(contorno_principal)
-        aspect_ratio = calcular_aspect_ratio(contorno_principal)
-        metricas_geo = [area, perimetro, circularidade, aspect_ratio]
-        
-    vetor_hog, img_visual_hog = extrair_hog(img_cinza) 
-    img_visual_lbp, hist_lbp = extrair_lbp(img_cinza)
-    metricas_glcm = extrair_glcm(img_cinza)
-        
+    return [area, perimetro, circularidade, aspect_ratio]
+
+
+@registrar_etapa('rgb', 'imagem')
+def _etapa_rgb(config, imagem):
+    return cv2.cvtColor(imagem, cv2.COLOR_BGR2RGB)
+
+
+@registrar_etapa('cinza', 'imagem')
+def _etapa_cinza(config, imagem):
+    return converter_para_cinza(imagem)
+
+
+@registrar_etapa('suavizacao', 'cinza')
+def _etapa_suavizacao(config, img_cinza):
+    return aplicar_filtro_gaussiano(img_cinza, config['gaussiano_kernel'])
+
+
+@registrar_etapa('canny', 'suavizacao')
+def _etapa_canny(config, img_suavizada):
+    return detectar_bordas_canny(img_suavizada, *config['canny_limiares'])
+
+
+@registrar_etapa('segmentacao', 'suavizacao')
+def _etapa_segmentacao(config, img_suavizada):
+    return segmentar_objeto_com_flood_fill(img_suavizada)
+
+
+@registrar_etapa('contornos', 'segmentacao')
+def _etapa_contornos(config, mascara_segmentada):
+    return encontrar_contornos(mascara_segmentada)
+
+
+@registrar_etapa('contornos_filtrados', 'contornos', 'imagem')
+def _etapa_contornos_filtrados(config, contornos, imagem):
+    altura_img, largura_img = imagem.shape[:2]
+    return filtrar_contornos_borda(contornos, largura_img, altura_img)
+
+
+@registrar_etapa('metricas_geo', 'contornos_filtrados', 'imagem')
+def _etapa_metricas_geo(config, contornos_filtrados, imagem):
+    altura_img, largura_img = imagem.shape[:2]
+    return metricas_geometricas(contornos_filtrados, altura_img, largura_img,
+                                normalizar=config['modo'] == MODO_DESCRITOR)
+
+
+@registrar_etapa('roi', 'contornos_filtrados', 'imagem')
+def _etapa_roi(config, contornos_filtrados, imagem):
+    # (caixa, contorno principal), ou None para usar o quadro inteiro.
+    contorno = contorno_principal(contornos_filtrados)
+    if contorno is None:
+        return None
+    altura_img, largura_img = imagem.shape[:2]
+    return caixa_com_margem(contorno, largura_img, altura_img, config.get('roi_margem', 0.1)), contorno
+
+
+@registrar_etapa('cinza_roi', 'cinza', 'imagem_decodificada', 'roi')
+def _etapa_cinza_roi(config, img_cinza, imagem_decodificada, roi):
+    largura, altura = config.get('roi_tamanho') or config['tamanho_canonico']
+    if roi is None:
+        return redimensionar(img_cinza, largura, altura)
+
+    # Caixa e contorno estão nas coordenadas da imagem normalizada; leva para a decodificada.
+    (x0, y0, x1, y1), contorno = roi
+    escala = np.array([imagem_decodificada.shape[1] / img_cinza.shape[1],
+                       imagem_decodificada.shape[0] / img_cinza.shape[0]])
+    caixa = (int(x0 * escala[0]), int(y0 * escala[1]),
+             max(int(np.ceil(x1 * escala[0])), int(x0 * escala[0]) + 1),
+             max(int(np.ceil(y1 * escala[1])), int(y0 * escala[1]) + 1))
+    contorno = np.round(contorno * escala).astype(np.int32) if config.get('roi_mascara') else None
+
+    recorte = converter_para_cinza(recortar_regiao(imagem_decodificada, caixa, contorno))
+    return redimensionar(recorte, largura, altura)
+
+
+def _entrada_textura(config):
+    return 'cinza_roi' if config.get('roi_recorte') else 'cinza'
+
+
+@registrar_etapa('contornos_desenhados', 'rgb', 'contornos_filtrados')
+def _etapa_contornos_desenhados(config, img_rgb, contornos_filtrados):
+    return desenhar_contornos(img_rgb, contornos_filtrados, cor=(0, 255, 0), espessura=2)
+
+
+@registrar_etapa('hog', _entrada_textura)
+def _etapa_hog(config, img_cinza):
+    vetor_hog, _ = extrair_hog(img_cinza, config['hog_orientacoes'], config['hog_pixels_por_celula'],
+                               config['hog_celulas_por_bloco'], visualizar=False)
+    return vetor_hog
+
+
+@registrar_etapa('hog_visual', _entrada_textura)
+def _etapa_hog_visual(config, img_cinza):
+    # (vetor, imagem): quem pede a visualização reaproveita o vetor em vez de pedir 'hog' também.
+    return extrair_hog(img_cinza, config['hog_orientacoes'], config['hog_pixels_por_celula'],
+                       config['hog_celulas_por_bloco'])
+
+
+def _bins_lbp(config):
+    # O LBP uniforme com P vizinhos gera P + 2 códigos: P + 1 padrões uniformes e um para os demais.
+    return config['lbp_p'] + 2 if config['modo'] == MODO_DESCRITOR or config['lbp_bins_fixos'] else None
+
+
+@registrar_etapa('lbp', _entrada_textura)
+def _etapa_lbp(config, img_cinza):
+    _, hist_lbp = extrair_lbp(img_cinza, P=config['lbp_p'], R=config['lbp_r'], bins=_bins_lbp(config),
+                              visualizar=False)
+    return hist_lbp
+
+
+@registrar_etapa('lbp_visual', _entrada_textura)
+def _etapa_lbp_visual(config, img_cinza):
+    # (imagem, histograma), na ordem de extrair_lbp.
+    return extrair_lbp(img_cinza, P=config['lbp_p'], R=config['lbp_r'], bins=_bins_lbp(config))
+
+
+@registrar_etapa('histograma_cor', 'imagem')
+def _etapa_histograma_cor(config, imagem):
+    return extrair_histograma_cor(imagem, config['histograma_cor_bins'])
+
+
+@registrar_etapa('glcm', _entrada_textura)
+def _etapa_glcm(config, img_cinza):
+    return extrair_glcm(img_cinza, config['glcm_distancias'], config['glcm_angulos'], config['glcm_niveis'],
+                        config['glcm_propriedades'])
+
+
+# Saídas do modo descritor: nada de RGB, Canny, desenhos ou imagens de visualização.
+DESCRITOR_SAIDAS = ('metricas_geo', 'hog', 'lbp', 'glcm')
+# Modo completo: mantém todas as saídas antigas, que entram no vetor concatenado.
+COMPLETO_SAIDAS = ('rgb', 'cinza', 'suavizacao', 'canny', 'segmentacao', 'contornos', 'contornos_filtrados',
+                   'contornos_desenhados', 'metricas_geo', 'hog_visual', 'lbp_visual', 'glcm')
+VISUALIZACAO_SAIDAS = ('imagem', 'cinza', 'suavizacao', 'segmentacao', 'canny', 'contornos_desenhados',
+                       'hog_visual', 'lbp_visual')
+
+
+def knn_process_descritor(image_process, config, imagem_decodificada=None):
+    """
+    Extrai um vetor compacto e de tamanho fixo: métricas geométricas, HOG,
+    histograma LBP com bins fixos e propriedades GLCM, calculados sobre a
+    imagem já no tamanho canônico (normalizar_entrada).
+    """
+    resultados = executar_etapas(image_process, DESCRITOR_SAIDAS, config, imagem_decodificada)
+
+    return {
+        'metricas_geo': np.array(resultados['metricas_geo']),
+        'vetor_hog': np.ravel(resultados['hog']),
+        'hist_lbp': np.ravel(resultados['lbp']),
+        'metricas_glcm': [resultados['glcm'][i] for i in resultados['glcm']],
+    }
+
+
+def knn_process_completo(image_process, config, imagem_decodificada=None):
+    resultados = executar_etapas(image_process, COMPLETO_SAIDAS, config, imagem_decodificada)
+    altura_img, largura_img = resultados['cinza'].shape
+    vetor_hog, img_visual_hog = resultados['hog_visual']
+    img_visual_lbp, hist_lbp = resultados['lbp_visual']
+    metricas_glcm = resultados['glcm']
+
     return {
         'image_process': np.ravel(image_process),
-        'img_rgb': np.ravel(img_rgb),
-        'img_cinza': np.ravel(img_cinza),
-        'img_suavizada': np.ravel(img_suavizada),
-        'img_bordas_canny': np.ravel(img_bordas_canny),
-        'mascara_segmentada': np.ravel(mascara_segmentada),
-        'contornos': ensure_flatten(contornos),
+        'img_rgb': np.ravel(resultados['rgb']),
+        'img_cinza': np.ravel(resultados['cinza']),
+        'img_suavizada': np.ravel(resultados['suavizacao']),
+        'img_bordas_canny': np.ravel(resultados['canny']),
+        'mascara_segmentada': np.ravel(resultados['segmentacao']),
+        'contornos': ensure_flatten(resultados['contornos']),
         'altura_img': np.ravel(altura_img),
         'largura_img': np.ravel(largura_img),
-        'contornos_filtrados': ensure_flatten(contornos_filtrados),
-        'mascara_final': np.ravel(mascara_final),
-        'img_com_contornos': np.ravel(img_com_contornos),
-        'metricas_geo': np.ravel(metricas_geo),
+        'contornos_filtrados': ensure_flatten(resultados['contornos_filtrados']),
+        'mascara_final': np.ravel(np.zeros_like(resultados['cinza'])),
+        'img_com_contornos': np.ravel(resultados['contornos_desenhados']),
+        'metricas_geo': np.ravel(resultados['metricas_geo']),
         'vetor_hog': np.ravel(vetor_hog),
         'img_visual_hog': np.ravel(img_visual_hog),
         'img_visual_lbp': np.ravel(img_visual_lbp),
         'hist_lbp': np.ravel(hist_lbp),
         'metricas_glcm': [metricas_glcm[i] for i in metricas_glcm],
-    }
\ No newline at end of file
+    }
+
+
+def knn_process_df_image(image_path=None, image_process=None, config=None, saidas=None):
+    """
+    Args:
+        saidas: Nomes de etapas (ver libs.pipeline.ETAPAS); quando informado,
+            retorna só essas saídas, calculando apenas as etapas de que dependem
+
+    Returns:
+        dict: Características do modo configurado, ou as saídas pedidas
+    """
+    config = {**PIPELINE_CONFIG, **(config or {})}
+    if image_path != None:
+        with open(image_path, 'rb') as f:
+            image_process = decodificar_entrada(f.read(), config)
+
+    imagem_decodificada = image_process
+    with etapa('normalizar'):
+        image_process = normalizar_entrada(image_process, config)
+
+    if saidas is not None:
+        return executar_etapas(image_process, saidas, config, imagem_decodificada)
+    if config['modo'] == MODO_DESCRITOR:
+        caracteristicas = knn_process_descritor(image_process, config, imagem_decodificada)
+    else:
+        caracteristicas = knn_process_completo(image_process, config, imagem_decodificada)
+
+    if not config.get('histograma_cor_bins'):
+        return caracteristicas
+    # Primeiro no dicionário: concatenar_caracteristicas o coloca nas primeiras colunas do vetor.
+    hist_cor = executar_etapas(image_process, ('histograma_cor',), config)['histograma_cor']
+    return {'hist_cor': hist_cor, **caracteristicas}
+
+
+def resultados_visualizacao(image_path=None, image_process=None, config=None):
+    """
+    Calcula as saídas de depuração no formato esperado por libs.visualization
+    (plotar_resultados_segmentacao, plotar_caracteristicas, plotar_histograma_lbp).
+    """
+    resultados = knn_process_df_image(image_path, image_process, config, saidas=VISUALIZACAO_SAIDAS)
+    lbp_imagem, lbp_histograma = resultados['lbp_visual']
+
+    return {
+        'imagem_original': resultados['imagem'],
+        'cinza': resultados['cinza'],
+        'gaussiano': resultados['suavizacao'],
+        'mascara_limpa': resultados['segmentacao'],
+        'bordas': resultados['canny'],
+        # Desenhada sobre a imagem RGB; a visualização espera BGR.
+        'imagem_contornos': cv2.cvtColor(resultados['contornos_desenhados'], cv2.COLOR_RGB2BGR),
+        'hog_imagem': resultados['hog_visual'][1],
+        'lbp_imagem': lbp_imagem,
+        'lbp_histograma': lbp_histograma,
+    }
@@ -0,0 +1,69 @@
+from libs.timers import etapa
+
+# Registro das etapas nomeadas: nome -> (entradas declaradas, função(config, *entradas)).
+# 'imagem' é a entrada do pipeline (BGR, já normalizada) e 'imagem_decodificada' a mesma imagem antes de
+# normalizar_entrada (por padrão, a própria 'imagem'); nenhuma das duas precisa ser registrada.
+ETAPAS = {}
+ENTRADA = 'imagem'
+ENTRADA_DECODIFICADA = 'imagem_decodificada'
+ENTRADAS = (ENTRADA, ENTRADA_DECODIFICADA)
+
+
+def registrar_etapa(nome, *entradas):
+    """
+    Decorador que registra uma etapa e as etapas de que ela depende.
+
+    Args:
+        nome: Nome da saída produzida (também usado nos tempos de libs.timers)
+        entradas: Nomes das etapas cujas saídas a função recebe, na ordem; uma
+            entrada também pode ser uma função config -> nome, resolvida a cada execução
+    """
+    def decorador(funcao):
+        ETAPAS[nome] = (entradas, funcao)
+        return funcao
+    return decorador
+
+
+def resolver_entradas(nome, config=None):
+    return [entrada(config or {}) if callable(entrada) else entrada for entrada in ETAPAS[nome][0]]
+
+
+def etapas_necessarias(saidas, config=None):
+    """
+    Returns:
+        list: Etapas que executar_etapas roda para produzir saidas, em ordem de execução
+    """
+    ordem = []
+
+    def visitar(nome):
+        if nome in ENTRADAS or nome in ordem:
+            return
+        if nome not in ETAPAS:
+            raise KeyError(f"Etapa desconhecida: {nome}")
+        for entrada in resolver_entradas(nome, config):
+            visitar(entrada)
+        ordem.append(nome)
+
+    for saida in saidas:
+        visitar(saida)
+    return ordem
+
+
+def executar_etapas(imagem, saidas, config, imagem_decodificada=None):
+    """
+    Calcula só as etapas de que saidas dependem, cada uma uma única vez; os
+    intermediários (cinza, suavizada, ...) são compartilhados entre elas.
+
+    Args:
+        imagem_decodificada: Imagem antes de normalizar_entrada, para etapas que
+            recortam na resolução decodificada (ex.: cinza_roi)
+
+    Returns:
+        dict: nome -> saída, para cada nome em saidas
+    """
+    valores = {ENTRADA: imagem, ENTRADA_DECODIFICADA: imagem if imagem_decodificada is None else imagem_decodificada}
+    for nome in etapas_necessarias(saidas, config):
+        funcao = ETAPAS[nome][1]
+        with etapa(nome):
+            valores[nome] = funcao(config, *(valores[entrada] for entrada in resolver_entradas(nome, config)))
+    return {nome: valores[nome] for nome in saidas}
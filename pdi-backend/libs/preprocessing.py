@@ -1,4 +1,11 @@
+import io
+
 import cv2
+import numpy as np
+from PIL import Image
+
+# Fatores de redução aplicados pelo libjpeg durante a decodificação (escala DCT), do maior ao menor.
+FATORES_REDUCAO = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
 
 
 def converter_para_cinza(imagem):
@@ -11,3 +18,49 @@ def aplicar_filtro_gaussiano(imagem, tamanho_kernel=(5, 5)):
 
 def detectar_bordas_canny(imagem, limiar_baixo=100, limiar_alto=200):
     return cv2.Canny(imagem, limiar_baixo, limiar_alto)
+
+
+def dimensoes_jpeg(dados):
+    """
+    Lê só o cabeçalho. Retorna (largura, altura) para JPEG e None para os demais
+    formatos, em que a decodificação reduzida não economiza trabalho.
+    """
+    try:
+        with Image.open(io.BytesIO(dados)) as imagem:
+            return imagem.size if imagem.format == 'JPEG' else None
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # DecompressionBombError (cabeçalho acima de ~179 MP) não deriva de OSError; o
+        # cv2.imdecode comum decide se a imagem é válida, como antes da decodificação reduzida.
+        return None
+
+
+def decodificar_reduzida(dados, tamanho_minimo):
+    """
+    Decodifica com o maior fator de IMREAD_REDUCED_COLOR_* que ainda deixa a
+    imagem com pelo menos o tamanho pedido.
+
+    Args:
+        tamanho_minimo: Função (largura, altura) -> (largura mínima, altura mínima),
+            chamada com as dimensões lidas do cabeçalho
+    """
+    flag = cv2.IMREAD_COLOR
+    dimensoes = dimensoes_jpeg(dados)
+    if dimensoes is not None:
+        largura, altura = dimensoes
+        largura_minima, altura_minima = tamanho_minimo(largura, altura)
+        for fator, flag_reduzida in FATORES_REDUCAO:
+            if largura // fator >= largura_minima and altura // fator >= altura_minima:
+                flag = flag_reduzida
+                break
+
+    try:
+        return cv2.imdecode(np.frombuffer(dados, np.uint8), flag)
+    except cv2.error:
+        # Algumas versões do OpenCV levantam erro (ex.: acima de CV_IO_MAX_IMAGE_PIXELS) em vez de retornar None.
+        return None
+
+
+def redimensionar(imagem, largura, altura):
+    if imagem.shape[:2] == (altura, largura):
+        return imagem
+    return cv2.resize(imagem, (largura, altura), interpolation=cv2.INTER_AREA)
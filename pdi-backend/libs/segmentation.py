@@ -37,3 +37,23 @@ def desenhar_contornos(imagem, contornos, cor=(0, 255, 0), espessura=2):
     imagem_contornos = imagem.copy()
     cv2.drawContours(imagem_contornos, contornos, -1, cor, espessura)
     return imagem_contornos
+
+def contorno_principal(contornos):
+    return max(contornos, key=cv2.contourArea) if len(contornos) > 0 else None
+
+def caixa_com_margem(contorno, largura_imagem, altura_imagem, margem=0.1):
+    x, y, w, h = cv2.boundingRect(contorno)
+    mx, my = int(round(w * margem)), int(round(h * margem))
+    return max(0, x - mx), max(0, y - my), min(largura_imagem, x + w + mx), min(altura_imagem, y + h + my)
+
+def recortar_regiao(imagem, caixa, contorno=None):
+    x0, y0, x1, y1 = caixa
+    recorte = imagem[y0:y1, x0:x1].copy()
+    
+    if contorno is not None:
+        # Máscara do contorno preenchido, nas coordenadas do recorte; o fundo vira 0.
+        mascara = np.zeros(recorte.shape[:2], np.uint8)
+        cv2.drawContours(mascara, [contorno - np.array([x0, y0])], -1, 255, thickness=cv2.FILLED)
+        recorte[mascara == 0] = 0
+    
+    return recorte
@@ -0,0 +1,63 @@
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+_ouvintes = []
+
+
+def registrar_ouvinte(ouvinte):
+    """
+    Registra uma função chamada como ouvinte(nome_etapa, segundos) ao fim de cada etapa.
+    """
+    _ouvintes.append(ouvinte)
+
+
+def remover_ouvinte(ouvinte):
+    _ouvintes.remove(ouvinte)
+
+
+class etapa:
+    """
+    Marca uma etapa do pipeline. Sem coletor ativo na thread nem ouvintes
+    registrados, não mede nada.
+    """
+
+    __slots__ = ('nome', 'inicio')
+
+    def __init__(self, nome):
+        self.nome = nome
+        self.inicio = None
+
+    def __enter__(self):
+        if _ouvintes or getattr(_local, 'tempos', None) is not None:
+            self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.inicio is None:
+            return False
+
+        segundos = time.perf_counter() - self.inicio
+        tempos = getattr(_local, 'tempos', None)
+        if tempos is not None:
+            tempos[self.nome] = tempos.get(self.nome, 0.0) + segundos
+        for ouvinte in _ouvintes:
+            ouvinte(self.nome, segundos)
+        return False
+
+
+@contextmanager
+def coletar_tempos():
+    """
+    Acumula, na thread atual, o tempo de cada etapa executada dentro do bloco.
+
+    Yields:
+        dict: nome da etapa -> segundos acumulados
+    """
+    anterior = getattr(_local, 'tempos', None)
+    _local.tempos = {}
+    try:
+        yield _local.tempos
+    finally:
+        _local.tempos = anterior
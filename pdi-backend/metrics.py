@@ -0,0 +1,152 @@
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from libs.timers import registrar_ouvinte
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_request = threading.local()
+
+_HELP = {'pdi_operation_seconds': 'Latência das operações do caminho de reconhecimento',
+         'pdi_operation_errors_total': 'Operações que terminaram com exceção',
+         'pdi_pipeline_stage_seconds': 'Latência das etapas de libs/knn_process.py',
+         'pdi_http_requests_total': 'Requisições HTTP por rota e status'}
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    spans = getattr(_request, 'spans', None)
+    if spans is not None:
+        span = labels.get('operation') or labels.get('stage') or name
+        spans[span] = spans.get(span, 0.0) + seconds
+
+
+def inc(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+class timed:
+    """
+    Mede um bloco ou função como pdi_operation_seconds{operation=nome}.
+    Desligado (METRICS_ENABLED=0), o decorador devolve a própria função.
+    """
+
+    __slots__ = ('operation', 'started_at')
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started_at = None
+
+    def __enter__(self):
+        if METRICS_ENABLED:
+            self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.started_at is not None:
+            observe('pdi_operation_seconds', time.perf_counter() - self.started_at, operation=self.operation)
+            if exc_type is not None:
+                inc('pdi_operation_errors_total', operation=self.operation)
+        return False
+
+    def __call__(self, func):
+        if not METRICS_ENABLED:
+            return func
+
+        operation = self.operation
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(operation):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def start_request():
+    if METRICS_ENABLED:
+        _request.spans = {}
+
+
+def finish_request(response, route):
+    spans = getattr(_request, 'spans', None)
+    _request.spans = None
+    if spans is None:
+        return response
+
+    inc('pdi_http_requests_total', route=route, status=str(response.status_code))
+    if spans:
+        response.headers['Server-Timing'] = ', '.join(f'{name};dur={seconds * 1000:.2f}'
+                                                      for name, seconds in spans.items())
+    return response
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+def render_prometheus():
+    with _lock:
+        histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for metric in sorted({name for name, _ in histograms}):
+        lines += [f'# HELP {metric} {_HELP.get(metric, metric)}', f'# TYPE {metric} histogram']
+        for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{metric}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {count}')
+
+    for metric in sorted({name for name, _ in counters}):
+        lines += [f'# HELP {metric} {_HELP.get(metric, metric)}', f'# TYPE {metric} counter']
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f'{metric}{_format_labels(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+if METRICS_ENABLED:
+    registrar_ouvinte(lambda stage, seconds: observe('pdi_pipeline_stage_seconds', seconds, stage=stage))
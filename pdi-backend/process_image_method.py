@@ -1,16 +1,70 @@
 import datetime
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import cv2
-import numpy as np
 from flask import jsonify
+from sqlalchemy.exc import IntegrityError
 
 from common import allowed_file, ALLOWED_EXTENSIONS
 from common import generate_hash
-from db_common import insert_data, select_data
+from db_common import insert_data, fetch_one, SequenceBlock
 from io_minio import upload_img
+from libs.knn_process import decodificar_entrada
+from metrics import timed, inc
+from result_cache import content_key
 
+MAX_BATCH_FILES = 32
+BATCH_IO_WORKERS = 8
+CONFIRM_WAIT_TIMEOUT = 10
+CONFIRM_POLL_INTERVAL = 0.2
+FK_PRODUCT_DATA_ID_DATA = 'fk_product_data_id_data_data'
 
-def process_image_exec(request, knn_default):
+data_ids = SequenceBlock('data')
+
+
+def __persist_upload__(id_data, path_data, dt_inclusion, image_bytes, content_type):
+    # Objeto antes da linha: a linha nunca aponta para uma imagem ausente, e repetir é seguro.
+    upload_img(None, content_type, key=path_data, image_bytes=image_bytes)
+    insert_data('data', [{'id_data': id_data,  #
+                          'path_data': path_data,  #
+                          'tp_data': 'IMG',  #
+                          'dt_inclusion': dt_inclusion  #
+                          }], ignore_conflicts=True)
+
+
+def __write_upload__(write_behind, id_data, path_data, raw_bytes, content_type):
+    dt_inclusion = datetime.datetime.now()
+    task = functools.partial(__persist_upload__, id_data, path_data, dt_inclusion, raw_bytes, content_type)
+    description = {'id_data': id_data, 'path_data': path_data, 'content_type': content_type,
+                   'dt_inclusion': dt_inclusion}
+
+    # Fila cheia: a requisição grava de forma síncrona em vez de descartar ou falhar.
+    if not write_behind.submit(f'data:{id_data}', task, description, payload=raw_bytes):
+        task()
+
+
+def __resolve_candidates__(candidate_lists, knn_default):
+    products = knn_default.get_products(sorted({c['id_product'] for candidates in candidate_lists for c in candidates}))
+
+    return [[{'id_product': c['id_product'],  #
+              'nm_product': products[c['id_product']]['nm_product'],  #
+              'vl_product': products[c['id_product']]['vl_product'],  #
+              'score': c['score']  #
+              } for c in candidates if c['id_product'] in products] for candidates in candidate_lists]
+
+
+def __candidates_response__(id_data, candidates):
+    return {'id_data': int(id_data),  #
+            'id_product': candidates[0]['id_product'],  #
+            'nm_product': candidates[0]['nm_product'],  #
+            'vl_product': candidates[0]['vl_product'],  #
+            'candidates': candidates  #
+            }
+
+
+@timed('process_image')
+def process_image_exec(request, knn_default, write_behind):
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'Nenhum arquivo foi enviado', 'code': 'NO_FILE'}), 400
@@ -24,14 +78,18 @@ def process_image_exec(request, knn_default):
             return jsonify({'error': f'Tipo de arquivo não permitido. Tipos aceitos: {", ".join(ALLOWED_EXTENSIONS)}',
                             'code': 'INVALID_FILE_TYPE'}), 400
 
-        file_bytes = np.frombuffer(file.read(), np.uint8)
-        img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+        with timed('decode'):
+            raw_bytes = file.read()
+            cache_key = content_key(raw_bytes)
+            img = decodificar_entrada(raw_bytes, knn_default.config)
 
         if img is None:
             return jsonify({'error': 'Não foi possível ler a imagem', 'code': 'INVALID_IMAGE'}), 400
 
         not_is_this_products = []
         id_data = None
+        path_data = None
+        new_upload = False
 
         if 'not-is' in request.form:
             if 'id_data' not in request.form:
@@ -41,39 +99,146 @@ def process_image_exec(request, knn_default):
             not_is_this_products = request.form['not-is'].split(',')
             not_is_this_products = [int(x) for x in not_is_this_products if x.strip().isdigit()]
         else:
-            path_data = generate_hash()
-            id_data = select_data('SELECT COUNT(*) FROM DATA')['count'].iloc[0] + 1
-            insert_data('data', [{'id_data': id_data,  #
-                                  'path_data': path_data,  #
-                                  'tp_data': 'IMG',  #
-                                  'dt_inclusion': datetime.datetime.now()  #
-                                  }])
-            upload_img(image=img, content_type=file.content_type, key=path_data)
-
-        knn_result = knn_default.knn_process_image(img, not_is_this_products)
-
-        df_product_result = select_data(f"""
-        SELECT p.* FROM data d
-        JOIN product_data pd ON pd.id_data = d.id_data
-        JOIN product p ON p.id_product = pd.id_product
-        WHERE d.path_data = '{knn_result}'
-        """)
-
-        return jsonify({'id_data': int(id_data),  #
-                        'id_product': int(df_product_result['id_product'].iloc[0]),  #
-                        'nm_product': df_product_result['nm_product'].iloc[0],  #
-                        'vl_product': float(df_product_result['vl_product'].iloc[0])  #
-                        }), 200
+            # Reenvio dos mesmos bytes (ex.: retry após erro de rede) reaproveita o dado já gravado.
+            upload = knn_default.result_cache.get_upload(cache_key)
+            if upload is not None:
+                id_data, path_data = upload
+            else:
+                path_data = generate_hash()
+                id_data = data_ids.next()[0]
+                new_upload = True
+
+        candidates = knn_default.knn_process_image(img, not_is_this_products, id_data=int(id_data), path_data=path_data,
+                                                   cache_key=cache_key)
+
+        if new_upload:
+            __write_upload__(write_behind, id_data, path_data, raw_bytes, file.content_type)
+
+        if not candidates:
+            return jsonify({'error': 'Nenhum produto restante para comparação', 'code': 'NO_CANDIDATES'}), 404
+
+        return jsonify(__candidates_response__(id_data, __resolve_candidates__([candidates], knn_default)[0])), 200
+
+    except Exception as e:
+        # A exceção não sai da função, então @timed não a conta.
+        inc('pdi_operation_errors_total', operation='process_image')
+        return jsonify({'error': f'Erro interno do servidor: {str(e)}', 'code': 'INTERNAL_ERROR'}), 500
+
+
+def __decode_batch_file__(file, config=None):
+    if file.filename == '':
+        return {'error': 'Nome do arquivo vazio', 'code': 'EMPTY_FILENAME'}
+
+    if not allowed_file(file.filename):
+        return {'error': f'Tipo de arquivo não permitido. Tipos aceitos: {", ".join(ALLOWED_EXTENSIONS)}',
+                'code': 'INVALID_FILE_TYPE'}
+
+    # Um arquivo com problema vira erro só na sua entrada; exceções aqui derrubariam o executor.map do lote.
+    try:
+        raw_bytes = file.read()
+        img = decodificar_entrada(raw_bytes, config)
+    except Exception as e:
+        return {'error': f'Erro ao ler a imagem: {e}', 'code': 'PROCESSING_ERROR'}
+    if img is None:
+        return {'error': 'Não foi possível ler a imagem', 'code': 'INVALID_IMAGE'}
+
+    return img, raw_bytes
+
+
+@timed('process_image_batch')
+def process_image_batch_exec(request, knn_default, write_behind):
+    try:
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({'error': 'Nenhum arquivo foi enviado', 'code': 'NO_FILE'}), 400
+
+        if len(files) > MAX_BATCH_FILES:
+            return jsonify({'error': f'Máximo de {MAX_BATCH_FILES} arquivos por lote', 'code': 'TOO_MANY_FILES'}), 400
+
+        with ThreadPoolExecutor(max_workers=BATCH_IO_WORKERS) as executor:
+            decoded = list(executor.map(functools.partial(__decode_batch_file__, config=knn_default.config), files))
+
+        results = [{'file': file.filename, **item} if isinstance(item, dict) else {'file': file.filename}
+                   for file, item in zip(files, decoded)]
+        valid = [i for i, item in enumerate(decoded) if not isinstance(item, dict)]
+
+        if not valid:
+            return jsonify({'results': results}), 200
+
+        paths_data = {i: generate_hash(f'{i}{files[i].filename}') for i in valid}
+        ids_data = dict(zip(valid, data_ids.next(len(valid))))
+
+        knn_results = knn_default.knn_process_images([decoded[i][0] for i in valid],  #
+                                                     ids_data=[ids_data[i] for i in valid],  #
+                                                     paths_data=[paths_data[i] for i in valid])
+
+        write_errors = {}
+        for i in valid:
+            # Com a fila cheia a gravação é síncrona; uma falha fica na entrada do arquivo, não no lote.
+            try:
+                __write_upload__(write_behind, ids_data[i], paths_data[i], decoded[i][1], files[i].content_type)
+            except Exception as e:
+                write_errors[i] = e
+
+        found = [(i, r) for i, r in zip(valid, knn_results) if not isinstance(r, Exception) and r]
+        resolved = dict(zip([i for i, _ in found], __resolve_candidates__([r for _, r in found], knn_default)))
+
+        for i, knn_result in zip(valid, knn_results):
+            if i in write_errors:
+                # Sem a linha de data gravada, o id_data não pode ser confirmado.
+                results[i].update({'error': f'Erro ao gravar a imagem: {write_errors[i]}', 'code': 'STORAGE_ERROR'})
+            elif isinstance(knn_result, Exception):
+                results[i].update({'id_data': ids_data[i], 'error': f'Erro ao processar a imagem: {knn_result}',
+                                   'code': 'PROCESSING_ERROR'})
+            elif not resolved.get(i):
+                results[i].update({'id_data': ids_data[i], 'error': 'Nenhum produto restante para comparação',
+                                   'code': 'NO_CANDIDATES'})
+            else:
+                results[i].update(__candidates_response__(ids_data[i], resolved[i]))
+
+        return jsonify({'results': results}), 200
 
     except Exception as e:
+        inc('pdi_operation_errors_total', operation='process_image_batch')
         return jsonify({'error': f'Erro interno do servidor: {str(e)}', 'code': 'INTERNAL_ERROR'}), 500
 
 
-def process_image_confirm_exec(request):
+def __insert_confirmation__(id_product, id_data, timeout=CONFIRM_WAIT_TIMEOUT):
+    """
+    Grava a confirmação. Se a linha de data ainda não existe (a gravação está na
+    fila de outro worker do gunicorn, que wait_for não enxerga), tenta de novo a
+    cada CONFIRM_POLL_INTERVAL até o timeout.
+
+    Returns:
+        dict | None: None se o dado já tinha confirmação
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return fetch_one("""
+            INSERT INTO product_data (id_product, id_data)
+            SELECT :id_product, :id_data
+            WHERE NOT EXISTS (SELECT 1 FROM product_data WHERE id_data = :id_data)
+            RETURNING id_product_data
+            """, {'id_product': id_product, 'id_data': id_data}, commit=True)
+        except IntegrityError as e:
+            diag = getattr(e.orig, 'diag', None)
+            if getattr(diag, 'constraint_name', None) != FK_PRODUCT_DATA_ID_DATA or time.monotonic() >= deadline:
+                raise
+            time.sleep(CONFIRM_POLL_INTERVAL)
+
+
+def process_image_confirm_exec(request, knn_default, write_behind):
     try:
         json = request.json
-        if len(select_data(f"SELECT * FROM product_data WHERE id_data = {json['id_data']}")) == 0:
-            insert_data('product_data', [{'id_product': json['id_product'], 'id_data': json['id_data']}])
+        # A linha de data pode ainda estar na fila de gravação; a FK de product_data depende dela.
+        # wait_for cobre o worker que recebeu o upload; os demais esperam em __insert_confirmation__.
+        deadline = time.monotonic() + CONFIRM_WAIT_TIMEOUT
+        write_behind.wait_for(f"data:{int(json['id_data'])}", CONFIRM_WAIT_TIMEOUT)
+        inserted = __insert_confirmation__(int(json['id_product']), int(json['id_data']),
+                                           max(0.0, deadline - time.monotonic()))
+        if inserted is not None:
+            knn_default.add_confirmed_image(int(json['id_data']), int(json['id_product']))
         return jsonify(json), 200
     except Exception as e:
         return jsonify({'error': f'Erro interno do servidor: {str(e)}', 'code': 'INTERNAL_ERROR'}), 500
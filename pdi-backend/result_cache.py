@@ -0,0 +1,166 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from metrics import inc
+
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_TTL = 600
+# Distância de Hamming máxima entre dHashes de 64 bits; None desliga a busca por quase-duplicatas.
+RESULT_CACHE_PHASH_DISTANCE = None
+ENTRY_OVERHEAD_BYTES = 512
+
+
+def content_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(image):
+    cinza = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    reduzida = cv2.resize(cinza, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (reduzida[:, 1:] > reduzida[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class ResultCache:
+    """
+    Cache LRU/TTL dos reconhecimentos, endereçado pelo sha256 dos bytes enviados.
+
+    Cada entrada guarda o vetor de características (válido enquanto a config do
+    pipeline for a mesma), os candidatos sem filtro not-is (válidos só para a
+    geração do índice em que foram calculados) e o upload original (id_data,
+    path_data). invalidate() descarta os candidatos sem perder os vetores.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL,
+                 phash_distance=RESULT_CACHE_PHASH_DISTANCE):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.phash_distance = phash_distance
+        self.entries = OrderedDict()
+        self.phashes = {}
+        self.generation = 0
+        self.bytes = 0
+        self.counts = {'hit': 0, 'near_hit': 0, 'vector_hit': 0, 'miss': 0, 'eviction': 0}
+        self.lock = threading.Lock()
+
+    def __count__(self, result):
+        self.counts[result] += 1
+        inc('pdi_result_cache_total', result=result)
+
+    def __remove__(self, key):
+        entry = self.entries.pop(key)
+        self.phashes.pop(key, None)
+        self.bytes -= entry['size']
+
+    def __expired__(self, entry, now):
+        return now - entry['created_at'] > self.ttl
+
+    def __near_duplicate__(self, phash, now):
+        for key, other in self.phashes.items():
+            if (phash ^ other).bit_count() <= self.phash_distance and not self.__expired__(self.entries[key], now):
+                return key
+        return None
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+
+    def get(self, key, image=None, with_candidates=True):
+        """
+        Args:
+            key: content_key dos bytes enviados
+            image: Imagem decodificada, usada só na busca por quase-duplicatas
+            with_candidates: False quando o chamador só vai reaproveitar o vetor
+                (consultas com not-is), para a estatística refletir o uso real
+
+        Returns:
+            dict | None: vector, id_data, path_data, candidates (None se o índice
+            mudou desde que foram calculados) e near (True se veio de outra foto,
+            por quase-duplicata)
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.__expired__(entry, now):
+                self.__remove__(key)
+                entry = None
+
+            near = False
+            if entry is None and self.phash_distance is not None and image is not None:
+                near_key = self.__near_duplicate__(perceptual_hash(image), now)
+                if near_key is not None:
+                    entry, key, near = self.entries[near_key], near_key, True
+
+            if entry is None:
+                self.__count__('miss')
+                return None
+
+            self.entries.move_to_end(key)
+            fresh = entry['generation'] == self.generation and entry['candidates'] is not None
+            self.__count__(('near_hit' if near else 'hit') if fresh and with_candidates else 'vector_hit')
+
+            return {'vector': entry['vector'],  #
+                    # Quase-duplicata é outra foto: reaproveita o resultado, mas não o upload.
+                    'id_data': None if near else entry['id_data'],  #
+                    'path_data': None if near else entry['path_data'],  #
+                    'candidates': [dict(c) for c in entry['candidates']] if fresh else None,  #
+                    'near': near  #
+                    }
+
+    def get_upload(self, key):
+        """
+        Returns:
+            tuple | None: (id_data, path_data) do upload original de bytes idênticos
+            ainda dentro do TTL; não conta nas estatísticas nem mexe na ordem LRU
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry['id_data'] is None or self.__expired__(entry, time.monotonic()):
+                return None
+            return entry['id_data'], entry['path_data']
+
+    def put(self, key, vector, candidates, id_data=None, path_data=None, image=None):
+        size = vector.nbytes + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+
+        phash = perceptual_hash(image) if self.phash_distance is not None and image is not None else None
+        with self.lock:
+            previous = self.entries.get(key)
+            if previous is not None:
+                id_data = previous['id_data'] if id_data is None else id_data
+                path_data = previous['path_data'] if path_data is None else path_data
+                if candidates is None and previous['generation'] == self.generation:
+                    candidates = previous['candidates']
+                self.__remove__(key)
+
+            self.entries[key] = {'vector': vector,  #
+                                 'candidates': None if candidates is None else [dict(c) for c in candidates],  #
+                                 'id_data': id_data,  #
+                                 'path_data': path_data,  #
+                                 'generation': self.generation,  #
+                                 'created_at': time.monotonic() if previous is None else previous['created_at'],  #
+                                 'size': size  #
+                                 }
+            if phash is not None:
+                self.phashes[key] = phash
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                self.__remove__(next(iter(self.entries)))
+                self.__count__('eviction')
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts['hit'] + self.counts['near_hit'] + self.counts['vector_hit'] + self.counts['miss']
+            return {**self.counts,  #
+                    'entries': len(self.entries),  #
+                    'bytes': self.bytes,  #
+                    'generation': self.generation,  #
+                    'hit_ratio': round((self.counts['hit'] + self.counts['near_hit']) / lookups, 4) if lookups else 0.0  #
+                    }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os módulos do backend são importados a partir de pdi-backend/ (ex.: from libs.knn_process import ...).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+import pytest
+
+import bulk_loader
+import io_minio
+from bulk_loader import fetch_images, extract_features, load_features
+from io_minio import FilesystemClient, put_many
+
+
+@pytest.fixture
+def objetos(tmp_path, monkeypatch):
+    monkeypatch.setattr(io_minio, 'minio_client', FilesystemClient(str(tmp_path)))
+    monkeypatch.setattr(io_minio, '_ensured_buckets', set())
+
+    rng = np.random.default_rng(0)
+    keys = [f'imagem-{i}' for i in range(6)]
+    put_many([(key, cv2.imencode('.jpg', rng.integers(0, 256, (400, 600, 3), dtype=np.uint8))[1].tobytes(),
+               'image/jpeg') for key in keys])
+    return keys
+
+
+def test_fetch_images_decodifica_reduzida_e_mantem_a_ordem(objetos):
+    imagens = fetch_images(objetos[:3] + ['nao-existe'] + objetos[3:], config={'modo': 'completo', 'lado_maximo': 150})
+
+    assert [imagem is None for imagem in imagens] == [False, False, False, True, False, False, False]
+    # Com lado_maximo 150, o JPEG de 600 x 400 já sai do libjpeg reduzido a 1/4.
+    assert all(imagem.shape == (100, 150, 3) for imagem in imagens if imagem is not None)
+
+
+@pytest.mark.parametrize('extract_workers', [1, 2])
+def test_load_features_baixa_e_extrai_por_bloco(objetos, monkeypatch, extract_workers):
+    config = {'modo': 'descritor'}
+    esperado = extract_features(fetch_images(objetos, config=config), config, workers=1)
+
+    blocos = []
+
+    def fetch_images_contado(paths, max_workers, config):
+        blocos.append(len(paths))
+        return fetch_images(paths, max_workers, config)
+
+    monkeypatch.setattr(bulk_loader, 'fetch_images', fetch_images_contado)
+    features, timings = load_features(objetos, config, extract_workers=extract_workers, chunk_size=2)
+
+    # Um bloco de extract_workers * chunk_size imagens por vez, nunca o catálogo inteiro.
+    tamanho = 2 * extract_workers
+    assert blocos == [min(tamanho, len(objetos) - i) for i in range(0, len(objetos), tamanho)]
+    assert set(timings) == {'download', 'extracao'}
+    for obtido, vetor in zip(features, esperado):
+        np.testing.assert_allclose(obtido, vetor)
@@ -0,0 +1,100 @@
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from libs.hog_features import calcular_gradientes, calcular_hog_array, calcular_hog_lote, dimensao_hog
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'dataset')
+PARAMETROS = [(9, (8, 8), (2, 2)), (12, (16, 16), (2, 2)), (6, (10, 12), (3, 2))]
+
+
+def hog_referencia(imagem, orientations=9, pixels_per_cell=(8, 8), cells_per_block=(2, 2)):
+    # Implementação pixel a pixel anterior à vetorização, mantida como referência de paridade.
+    altura, largura = imagem.shape
+    cell_h, cell_w = pixels_per_cell
+    block_h, block_w = cells_per_block
+
+    magnitude, angulo = calcular_gradientes(imagem)
+    n_cells_h = altura // cell_h
+    n_cells_w = largura // cell_w
+    cell_histograms = np.zeros((n_cells_h, n_cells_w, orientations))
+    bin_size = 180 / orientations
+
+    for i in range(n_cells_h):
+        for j in range(n_cells_w):
+            cell_mag = magnitude[i * cell_h:(i + 1) * cell_h, j * cell_w:(j + 1) * cell_w]
+            cell_ang = angulo[i * cell_h:(i + 1) * cell_h, j * cell_w:(j + 1) * cell_w]
+            for y in range(cell_h):
+                for x in range(cell_w):
+                    bin_idx = cell_ang[y, x] / bin_size
+                    bin_low = int(bin_idx) % orientations
+                    bin_high = (bin_low + 1) % orientations
+                    weight = bin_idx - int(bin_idx)
+                    cell_histograms[i, j, bin_low] += cell_mag[y, x] * (1 - weight)
+                    cell_histograms[i, j, bin_high] += cell_mag[y, x] * weight
+
+    hog_features = []
+    for i in range(n_cells_h - block_h + 1):
+        for j in range(n_cells_w - block_w + 1):
+            block_vector = cell_histograms[i:i + block_h, j:j + block_w, :].flatten()
+            hog_features.extend(block_vector / np.sqrt(np.sum(block_vector ** 2) + 1e-6))
+
+    hog_features = np.array(hog_features, dtype=np.float32)
+    return hog_features / (np.linalg.norm(hog_features) + 1e-8)
+
+
+def imagens_aleatorias(n, altura, largura, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (n, altura, largura), dtype=np.uint8)
+
+
+def imagens_dataset(n, tamanho=(100, 100)):
+    arquivos = sorted(glob.glob(os.path.join(DATASET_PATH, '*', '*')))[::500][:n]
+    if not arquivos:
+        pytest.skip('dataset/ indisponível')
+    return np.stack([cv2.resize(cv2.imread(arquivo, cv2.IMREAD_GRAYSCALE), tamanho) for arquivo in arquivos])
+
+
+@pytest.mark.parametrize('orientations, pixels_per_cell, cells_per_block', PARAMETROS)
+def test_calcular_hog_array_igual_a_referencia(orientations, pixels_per_cell, cells_per_block):
+    # 67 x 93 não é múltiplo do tamanho da célula: confere também o descarte das bordas.
+    for imagem in imagens_aleatorias(3, 67, 93):
+        esperado = hog_referencia(imagem, orientations, pixels_per_cell, cells_per_block)
+        obtido = np.array(calcular_hog_array(imagem, orientations, pixels_per_cell, cells_per_block))
+        np.testing.assert_allclose(obtido, esperado, atol=1e-6)
+        assert len(obtido) == dimensao_hog(*imagem.shape, orientations, pixels_per_cell, cells_per_block)
+
+
+def test_calcular_hog_array_igual_a_referencia_no_dataset():
+    for imagem in imagens_dataset(5):
+        np.testing.assert_allclose(calcular_hog_array(imagem), hog_referencia(imagem), atol=1e-6)
+
+
+@pytest.mark.parametrize('orientations, pixels_per_cell, cells_per_block', PARAMETROS)
+def test_calcular_hog_lote_igual_a_referencia(orientations, pixels_per_cell, cells_per_block):
+    imagens = imagens_aleatorias(5, 64, 80, seed=1)
+    esperado = np.vstack([hog_referencia(imagem, orientations, pixels_per_cell, cells_per_block) for imagem in imagens])
+
+    # tamanho_lote=2 força mais de um lote, inclusive um incompleto.
+    obtido = calcular_hog_lote(imagens, orientations, pixels_per_cell, cells_per_block, tamanho_lote=2)
+
+    assert obtido.dtype == np.float32
+    np.testing.assert_allclose(obtido, esperado, atol=1e-6)
+
+
+def test_calcular_hog_lote_dataset_com_processos():
+    imagens = imagens_dataset(4)
+    esperado = np.vstack([hog_referencia(imagem) for imagem in imagens])
+    np.testing.assert_allclose(calcular_hog_lote(imagens, workers=2, tamanho_lote=2), esperado, atol=1e-6)
+
+
+def test_calcular_hog_lote_pilha_vazia():
+    assert calcular_hog_lote(np.empty((0, 64, 80), dtype=np.uint8)).shape == (0, dimensao_hog(64, 80))
+    assert calcular_hog_lote([]).shape == (0, 0)
+
+
+def test_calcular_hog_lote_rejeita_formatos_diferentes():
+    with pytest.raises(ValueError):
+        calcular_hog_lote([np.zeros((64, 64), np.uint8), np.zeros((64, 32), np.uint8)])
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from index_file import write_index, read_index
+from knn_process_image import INDEX_BACKENDS, INDEX_CASCADE
+
+
+@pytest.mark.parametrize('kind', sorted(INDEX_BACKENDS))
+def test_indice_lido_do_arquivo_responde_igual_ao_original(kind, tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.random((300, 48), dtype=np.float32)
+    params = {'prefilter_dim': 8} if kind == INDEX_CASCADE else {}
+    index = INDEX_BACKENDS[kind](**params).build(vectors)
+
+    path = str(tmp_path / 'indice.pdi')
+    write_index(path, index, np.arange(len(vectors)), np.arange(len(vectors)) % 7,
+                [f'objeto-{i}' for i in range(len(vectors))], 'hash')
+    header, arrays, _ = read_index(path, verify=True)
+    lido = INDEX_BACKENDS[header['kind']].from_arrays(arrays, header['params'])
+
+    queries = rng.random((5, 48), dtype=np.float32)
+    for (dist_a, idx_a), (dist_b, idx_b) in zip(index.query(queries, 10), lido.query(queries, 10)):
+        np.testing.assert_array_equal(idx_a, idx_b)
+        np.testing.assert_allclose(dist_a, dist_b)
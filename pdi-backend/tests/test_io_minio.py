@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+import pytest
+
+import io_minio
+from io_minio import FilesystemClient, put_many, get_many, upload_img, get_image_minio, get_single_object_img, \
+    decode_img
+
+
+class ContadorClient(FilesystemClient):
+    # FilesystemClient que conta as chamadas, para conferir o cache de ensure_bucket.
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.chamadas = {'head_bucket': 0, 'create_bucket': 0}
+
+    def head_bucket(self, Bucket):
+        self.chamadas['head_bucket'] += 1
+        return super().head_bucket(Bucket)
+
+    def create_bucket(self, Bucket):
+        self.chamadas['create_bucket'] += 1
+        return super().create_bucket(Bucket)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    client = ContadorClient(str(tmp_path))
+    monkeypatch.setattr(io_minio, 'minio_client', client)
+    monkeypatch.setattr(io_minio, '_ensured_buckets', set())
+    return client
+
+
+def test_put_many_get_many(client):
+    items = [(f'pasta/objeto-{i}', bytes([i]) * (i + 1), 'application/octet-stream') for i in range(20)]
+
+    assert put_many(items, max_workers=4) == [None] * len(items)
+    assert get_many([key for key, _, _ in items], max_workers=4) == [data for _, data, _ in items]
+
+
+def test_get_many_objeto_ausente_vira_none(client):
+    put_many([('existe', b'conteudo', 'text/plain')])
+
+    assert get_many(['existe', 'nao-existe', 'existe']) == [b'conteudo', None, b'conteudo']
+    assert get_image_minio('nao-existe') is None
+
+
+def test_put_many_reporta_erro_por_item(client):
+    resultados = put_many([('ok', b'1', 'text/plain'), ('invalido', None, 'text/plain')])
+
+    assert resultados[0] is None
+    assert isinstance(resultados[1], Exception)
+    assert get_image_minio('ok') == b'1'
+
+
+def test_bucket_verificado_uma_vez_por_processo(client):
+    for i in range(5):
+        put_many([(f'objeto-{i}', b'x', 'text/plain')])
+    put_many([('outro', b'y', 'text/plain')], bucket_name='outro-bucket')
+
+    # Um head_bucket (e um create_bucket, já que o diretório não existia) por bucket.
+    assert client.chamadas == {'head_bucket': 2, 'create_bucket': 2}
+
+
+def test_upload_img_envia_bytes_originais(client):
+    imagem = np.random.default_rng(0).integers(0, 256, (32, 48, 3), dtype=np.uint8)
+    _, buffer = cv2.imencode('.jpg', imagem)
+    # Bytes extras depois do EOI: uma recodificação não os preservaria.
+    original = buffer.tobytes() + b'metadados'
+
+    key = upload_img(cv2.imdecode(buffer, cv2.IMREAD_COLOR), 'image/jpeg', image_bytes=original)
+
+    assert get_image_minio(key) == original
+    assert get_single_object_img(key).shape == (32, 48, 3)
+    assert get_many([key], decode=True)[0].shape == (32, 48, 3)
+
+
+def test_get_many_decodifica_com_funcao_nas_threads(client):
+    imagem = np.random.default_rng(1).integers(0, 256, (40, 60, 3), dtype=np.uint8)
+    key = upload_img(imagem, 'image/png')
+
+    reduzidas = get_many([key, 'nao-existe'], decode=lambda data: cv2.resize(decode_img(data), (30, 20)))
+
+    assert reduzidas[0].shape == (20, 30, 3)
+    assert reduzidas[1] is None
+    assert get_many([]) == []
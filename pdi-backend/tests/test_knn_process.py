@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+
+from libs.knn_process import knn_process_df_image, MODO_DESCRITOR
+
+
+@pytest.mark.parametrize('lbp_p', [4, 8, 16])
+def test_histograma_lbp_tem_um_bin_por_codigo_uniforme(lbp_p):
+    imagem = np.random.default_rng(0).integers(0, 256, (120, 90, 3), dtype=np.uint8)
+
+    for config in ({'modo': MODO_DESCRITOR, 'lbp_p': lbp_p}, {'lbp_bins_fixos': True, 'lbp_p': lbp_p}):
+        hist_lbp = knn_process_df_image(image_process=imagem, config=config)['hist_lbp']
+        # Nenhum código descartado: P + 2 bins e a densidade soma 1.
+        assert len(hist_lbp) == lbp_p + 2
+        assert hist_lbp.sum() == pytest.approx(1.0)
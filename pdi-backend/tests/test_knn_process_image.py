@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+
+import knn_process_image
+from knn_process_image import CascadeIndex, ExactIndex, KNN, fit_scaler, standardize
+from result_cache import ResultCache
+
+
+def test_exact_filtro_igual_a_indice_so_com_as_linhas_permitidas():
+    rng = np.random.default_rng(1)
+    vectors = rng.random((400, 48), dtype=np.float32)
+    allowed = rng.random(len(vectors)) > 0.3
+    index = ExactIndex().build(vectors)
+    referencia = ExactIndex().build(vectors[allowed])
+
+    queries = rng.random((5, 48), dtype=np.float32)
+    for (dist_a, idx_a), (dist_b, idx_b) in zip(index.query(queries, 10, allowed), referencia.query(queries, 10)):
+        np.testing.assert_array_equal(idx_a, np.flatnonzero(allowed)[idx_b])
+        np.testing.assert_allclose(dist_a, dist_b, rtol=1e-5)
+
+
+def test_exact_filtro_com_menos_linhas_que_k():
+    vectors = np.random.default_rng(2).random((50, 8), dtype=np.float32)
+    allowed = np.zeros(len(vectors), dtype=bool)
+    allowed[[3, 17, 41]] = True
+
+    distances, indices = ExactIndex().build(vectors).query(vectors[17], 10, allowed)[0]
+
+    assert sorted(indices.tolist()) == [3, 17, 41]
+    assert indices[0] == 17 and np.isfinite(distances).all()
+
+
+def catalogo(n=300, dim=24, seed=3):
+    # Uma coluna com escala 10^3 vezes maior que as outras, como o contrast do GLCM no descritor.
+    rng = np.random.default_rng(seed)
+    vectors = rng.random((n, dim), dtype=np.float32)
+    vectors[:, 0] *= 1000
+    df_database_images = pd.DataFrame({'id_data': np.arange(n), 'path_data': [f'objeto-{i}' for i in range(n)],  #
+                                       'id_product': np.arange(n) % 5  #
+                                       })
+    return df_database_images, vectors
+
+
+def snapshot_em_memoria(id_data, vectors, scaler):
+    # O DataFrame que load_feature_snapshot devolveria, sem passar pelo MinIO.
+    df_snapshot = pd.DataFrame({'id_data': np.asarray(id_data), 'features': list(vectors)})
+    df_snapshot.attrs.update({'watermark': int(df_snapshot['id_data'].max()),  #
+                              'scaler_mean': scaler['mean'].tolist(),  #
+                              'scaler_std': scaler['std'].tolist()  #
+                              })
+    return df_snapshot
+
+
+def knn_em_memoria(df_database_images, vectors, **kwargs):
+    knn = KNN(autoload=False, result_cache=ResultCache(), **kwargs)
+    knn.load_from_matrix(df_database_images, vectors)
+    return knn
+
+
+def test_fit_scaler_em_blocos_igual_a_numpy(monkeypatch):
+    vectors = catalogo()[1]
+    vectors[:, 5] = 7.0
+    monkeypatch.setattr(knn_process_image, 'SCALER_CHUNK', 64)
+
+    scaler = fit_scaler(vectors)
+
+    np.testing.assert_allclose(scaler['mean'], vectors.mean(axis=0), rtol=1e-5)
+    np.testing.assert_allclose(np.delete(scaler['std'], 5), np.delete(vectors.std(axis=0), 5), rtol=1e-4)
+    # Coluna constante: std 1, para não dividir por zero.
+    assert scaler['std'][5] == 1.0
+
+
+def test_busca_usa_a_distancia_padronizada():
+    df_database_images, vectors = catalogo()
+    knn = knn_em_memoria(df_database_images, vectors)
+    scaled = standardize(vectors, knn.scaler)
+
+    np.testing.assert_allclose(knn.index.vectors, scaled, rtol=1e-5, atol=1e-5)
+    esperado = np.argsort(np.linalg.norm(scaled - scaled[7], axis=1), kind='stable')[:knn.n_neighbors]
+    distances, indices = knn.index.query(scaled[7], knn.n_neighbors)[0]
+    np.testing.assert_array_equal(indices, esperado)
+
+    # A consulta chega como extraída e passa pelo mesmo scaler dentro da busca.
+    candidates = knn.__search__(knn.__load_df_database_images__(), vectors[7][None], [], 1)[0]
+    assert candidates[0]['image_path'] == 'objeto-7' and candidates[0]['distance'] == 0
+
+
+def test_delta_de_confirmacoes_padronizado_como_o_indice():
+    df_database_images, vectors = catalogo()
+    knn = knn_em_memoria(df_database_images.iloc[:-1], vectors[:-1])
+    novo = vectors[-1]
+
+    # Como em knn_process_image: o vetor da consulta fica guardado, sem padronizar, até a confirmação.
+    knn.__remember_vector__(999, 'objeto-novo', novo)
+    assert knn.add_confirmed_image(999, 4)
+
+    candidates = knn.__search__(knn.__load_df_database_images__(), novo[None], [], 1)[0]
+    assert candidates[0]['image_path'] == 'objeto-novo' and candidates[0]['distance'] == 0
+
+
+def test_scaler_gravado_no_arquivo_pdi(tmp_path):
+    df_database_images, vectors = catalogo()
+    knn = knn_em_memoria(df_database_images, vectors)
+    path = str(tmp_path / 'indice.pdi')
+    knn.save_index_file(path)
+
+    anexado = KNN(autoload=False, result_cache=ResultCache())
+    anexado.load_index_file(path, verify=True)
+
+    np.testing.assert_array_equal(anexado.scaler['mean'], knn.scaler['mean'])
+    np.testing.assert_array_equal(anexado.scaler['std'], knn.scaler['std'])
+    state = anexado.__load_df_database_images__()
+    assert anexado.__search__(state, vectors[42][None], [], 1)[0][0]['image_path'] == 'objeto-42'
+
+
+def test_arquivo_pdi_mantem_metadados_em_memmap_e_filtra_o_delta(tmp_path, monkeypatch):
+    df_database_images, vectors = catalogo()
+    knn = knn_em_memoria(df_database_images.iloc[:-1], vectors[:-1])
+    path = str(tmp_path / 'indice.pdi')
+    knn.save_index_file(path)
+
+    anexado = KNN(autoload=False, result_cache=ResultCache())
+    monkeypatch.setattr(knn_process_image, 'save_feature_snapshot', lambda *args, **kwargs: None)
+    novo = len(vectors) - 1
+    for i in (3, novo):
+        anexado.__remember_vector__(i, f'objeto-{i}', vectors[i])
+        anexado.add_confirmed_image(i, 0)
+    anexado.load_index_file(path)
+
+    assert all(isinstance(anexado.metadata[name], np.memmap) for name in ('id_data', 'path_data'))
+    assert [row['id_data'] for row in anexado.delta_rows] == [novo]
+
+    # A compactação mistura caminhos do arquivo (bytes) e do delta (str); a regravação aceita os dois.
+    anexado.__compact_delta__()
+    regravado = str(tmp_path / 'regravado.pdi')
+    anexado.save_index_file(regravado)
+    relido = KNN(autoload=False, result_cache=ResultCache())
+    relido.load_index_file(regravado)
+    state = relido.__load_df_database_images__()
+    for i in (0, novo):
+        assert relido.__search__(state, vectors[i][None], [], 1)[0][0]['image_path'] == f'objeto-{i}'
+
+
+def test_sem_padronizar_mantem_os_vetores():
+    df_database_images, vectors = catalogo()
+    knn = knn_em_memoria(df_database_images, vectors, standardize=False)
+
+    assert knn.scaler is None
+    np.testing.assert_array_equal(knn.index.vectors, vectors)
+
+
+def test_compactacao_do_delta_grava_snapshot_sem_padronizar(monkeypatch):
+    df_database_images, vectors = catalogo()
+    knn = knn_em_memoria(df_database_images.iloc[:-3], vectors[:-3])
+    gravados = {}
+
+    def save_feature_snapshot(config_hash, id_data, features, scaler=None):
+        gravados.update(id_data=id_data, features=features, scaler=scaler)
+
+    monkeypatch.setattr(knn_process_image, 'save_feature_snapshot', save_feature_snapshot)
+    for i in range(len(vectors) - 3, len(vectors)):
+        knn.__remember_vector__(i, f'objeto-{i}', vectors[i])
+        knn.add_confirmed_image(i, 0)
+
+    knn.__compact_delta__()
+
+    assert len(knn.index) == len(vectors) and not knn.delta_rows
+    np.testing.assert_allclose(knn.index.vectors, standardize(vectors, knn.scaler), rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(np.vstack(gravados['features']), vectors, rtol=1e-5, atol=1e-3)
+    assert gravados['scaler'] is knn.scaler
+
+
+def test_carga_reaproveita_o_scaler_do_snapshot_so_sem_vetores_novos(monkeypatch):
+    df_database_images, vectors = catalogo()
+    snapshot = snapshot_em_memoria(df_database_images['id_data'], vectors,
+                                   {'mean': np.ones(vectors.shape[1], np.float32),  #
+                                    'std': np.full(vectors.shape[1], 2, np.float32)  #
+                                    })
+    monkeypatch.setattr(knn_process_image, 'select_data', lambda sql: df_database_images)
+    monkeypatch.setattr(knn_process_image, 'load_feature_snapshot', lambda config_hash: snapshot)
+    gravados = []
+    monkeypatch.setattr(knn_process_image, 'save_feature_snapshot', lambda *args: gravados.append(args))
+
+    knn = KNN(result_cache=ResultCache())
+    np.testing.assert_array_equal(knn.scaler['std'], 2)
+    assert not gravados
+
+    # Uma linha fora do snapshot: extrai, ajusta o scaler de novo e grava o snapshot com ele.
+    snapshot.drop(index=snapshot.index[-1], inplace=True)
+    monkeypatch.setattr(knn_process_image, 'load_features', lambda paths, config, extract_workers: ([vectors[-1]], {}))
+    knn = KNN(result_cache=ResultCache())
+    np.testing.assert_allclose(knn.scaler['mean'], vectors.mean(axis=0), rtol=1e-5)
+    assert gravados[0][3] is knn.scaler
+
+
+def test_cascata_com_filtro_e_shortlist_completa_igual_a_busca_exata_no_descritor():
+    rng = np.random.default_rng(4)
+    vectors = rng.random((200, 40), dtype=np.float32)
+    allowed = rng.random(len(vectors)) > 0.5
+    cascade = CascadeIndex(prefilter_dim=8, shortlist=len(vectors)).build(vectors)
+    referencia = ExactIndex().build(vectors[allowed, 8:])
+
+    queries = rng.random((4, 40), dtype=np.float32)
+    resultados = zip(cascade.query(queries, 5, allowed), referencia.query(queries[:, 8:], 5))
+    for (dist_a, idx_a), (dist_b, idx_b) in resultados:
+        np.testing.assert_array_equal(idx_a, np.flatnonzero(allowed)[idx_b])
+        np.testing.assert_allclose(dist_a, dist_b, rtol=1e-5)
+
+    # Shortlist menor que o catálogo: só linhas permitidas entram.
+    cascade.shortlist = 20
+    assert all(allowed[indices].all() for _, indices in cascade.query(queries, 5, allowed))
@@ -0,0 +1,183 @@
+import datetime
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+from metrics import inc
+
+WRITE_QUEUE_SIZE = 256
+WRITE_WORKERS = 4
+WRITE_MAX_ATTEMPTS = 5
+WRITE_BACKOFF_BASE = 0.5
+WRITE_BACKOFF_MAX = 30
+# Quanto uma requisição espera por espaço na fila antes de gravar de forma síncrona.
+WRITE_ENQUEUE_TIMEOUT = 2
+DEAD_LETTER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dead_letter')
+
+_STOP = object()
+
+
+class WriteBehind:
+    """
+    Fila limitada de gravações (MinIO, Postgres) executadas por threads depois
+    que a resposta já foi calculada. Cada tarefa é repetida com backoff
+    exponencial; após WRITE_MAX_ATTEMPTS vai para o dead-letter em
+    DEAD_LETTER_DIR (dead_letter.jsonl + payload, para reprocessar).
+    """
+
+    def __init__(self, workers=WRITE_WORKERS, maxsize=WRITE_QUEUE_SIZE, max_attempts=WRITE_MAX_ATTEMPTS,
+                 dead_letter_dir=DEAD_LETTER_DIR):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.dead_letter_dir = dead_letter_dir
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.pending = {}
+        self.threads = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.threads or self.closed:
+                return self
+            self.threads = [threading.Thread(target=self.__worker__, name=f'write-behind-{i}', daemon=True)
+                            for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def submit(self, key, task, description=None, payload=None, timeout=WRITE_ENQUEUE_TIMEOUT):
+        """
+        Enfileira task() para execução em segundo plano.
+
+        Args:
+            key: Identificador da gravação, usado por wait_for (ex.: 'data:123')
+            task: Função sem argumentos; deve ser idempotente, pois pode ser repetida
+            description: dict serializável registrado no dead-letter
+            payload: bytes salvos junto ao dead-letter (ex.: a imagem original)
+            timeout: Segundos esperando espaço na fila
+
+        Returns:
+            bool: False se a fila continuou cheia (ou o writer está fechado); o
+            chamador deve então gravar de forma síncrona
+        """
+        if self.closed:
+            return False
+        self.start()
+
+        event = threading.Event()
+        with self.lock:
+            self.pending[key] = event
+        try:
+            self.queue.put((key, task, description or {}, payload, event), timeout=timeout)
+        except queue.Full:
+            with self.lock:
+                self.pending.pop(key, None)
+            inc('pdi_write_behind_total', result='queue_full')
+            return False
+
+        inc('pdi_write_behind_total', result='queued')
+        return True
+
+    def wait_for(self, key, timeout=None):
+        """
+        Bloqueia até a gravação key terminar (com sucesso ou no dead-letter).
+
+        Returns:
+            bool: False se o timeout expirou antes
+        """
+        with self.lock:
+            event = self.pending.get(key)
+        return True if event is None else event.wait(timeout)
+
+    def __worker__(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self.__run__(*item)
+            except Exception as e:
+                print(f"[write_behind] Erro inesperado no worker: {e}")
+            finally:
+                self.queue.task_done()
+
+    def __run__(self, key, task, description, payload, event):
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    task()
+                    inc('pdi_write_behind_total', result='ok')
+                    return
+                except Exception as e:
+                    if attempt == self.max_attempts:
+                        self.__dead_letter__(key, description, payload, attempt, e)
+                        return
+                    inc('pdi_write_behind_total', result='retry')
+                    backoff = min(WRITE_BACKOFF_BASE * 2 ** (attempt - 1), WRITE_BACKOFF_MAX)
+                    time.sleep(backoff * (0.5 + random.random() / 2))
+        finally:
+            event.set()
+            with self.lock:
+                if self.pending.get(key) is event:
+                    del self.pending[key]
+
+    def __dead_letter__(self, key, description, payload, attempts, error):
+        inc('pdi_write_behind_total', result='dead_letter')
+        print(f"[write_behind] Falha definitiva em '{key}' após {attempts} tentativas: {error}")
+
+        os.makedirs(self.dead_letter_dir, exist_ok=True)
+        payload_file = None
+        if payload is not None:
+            payload_file = os.path.join(self.dead_letter_dir, key.replace(':', '_'))
+            with open(payload_file, 'wb') as f:
+                f.write(payload)
+
+        registro = {'key': key,  #
+                    'description': description,  #
+                    'payload_file': payload_file,  #
+                    'attempts': attempts,  #
+                    'error': str(error),  #
+                    'failed_at': datetime.datetime.now().isoformat()  #
+                    }
+        with self.lock, open(os.path.join(self.dead_letter_dir, 'dead_letter.jsonl'), 'a') as f:
+            f.write(json.dumps(registro, default=str) + '\n')
+
+    def shutdown(self, timeout=None):
+        """
+        Para de aceitar tarefas e espera a fila esvaziar (inclusive as novas
+        tentativas em andamento).
+
+        Returns:
+            bool: False se alguma thread ainda estava ativa ao fim do timeout
+        """
+        with self.lock:
+            if self.closed and not any(thread.is_alive() for thread in self.threads):
+                return True
+            self.closed = True
+            threads = list(self.threads)
+        for _ in threads:
+            self.queue.put(_STOP)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+        drained = not any(thread.is_alive() for thread in threads)
+        if drained:
+            # Tarefas enfileiradas por um submit concorrente depois das sentinelas.
+            while not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is not _STOP:
+                    self.__run__(*item)
+        print(f"[write_behind] Encerrado: {self.queue.qsize()} itens na fila, "
+              f"{'drenado' if drained else 'timeout ao drenar'}")
+        return drained
+
+    def stats(self):
+        with self.lock:
+            return {'queued': self.queue.qsize(), 'pending': len(self.pending), 'workers': len(self.threads),
+                    'closed': self.closed}